@@ -4,11 +4,10 @@ import uuid
 import logging
 import argparse
 import aiohttp
-import dateparser
 import json
 import time
 from typing import List, Dict, Tuple
-from datetime import datetime, timedelta
+from datetime import datetime
 from bs4 import BeautifulSoup
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -18,6 +17,10 @@ from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
 
 from logging_converter import string_to_logging_level
+from lxml_extraction import CompiledSelectors, get_profile_block, parse_main_page, parse_user_page
+from post_feed import PostFeed
+from profile_cache import ProfileCache, username_from_url
+from profile_fetchers import HttpProfileFetcher, BrowserProfileFetcher
 
 
 def write_to_file(filename: str, data: List[str]) -> None:
@@ -65,13 +68,6 @@ def truncate_file_content(filename: str) -> None:
             file.truncate()
 
 
-def get_posts_list(html, xpath_templates):
-    soup = BeautifulSoup(html, "lxml")
-    all_posts_html = soup.select_one(xpath_templates["all_posts_block"])
-
-    return all_posts_html.find_all("div", class_="Post")
-
-
 def config_logger(log_level: int) -> logging.Logger:
     logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
     logger = logging.getLogger("reddit_parser")
@@ -79,88 +75,11 @@ def config_logger(log_level: int) -> logging.Logger:
     return logger
 
 
-async def get_user_html_from_new_browser_tab(browser, user_page_url, xpath_templates):
-    browser.execute_script(f"window.open('{user_page_url}');")
-    await asyncio.sleep(1)
-    browser.switch_to.window(browser.window_handles[1])
-    user_page_html = browser.page_source
-    soup = BeautifulSoup(user_page_html, "lxml")
-    user_profile_info = soup.select_one(xpath_templates["user_profile_block"])
-
-    browser.close()
-    browser.switch_to.window(browser.window_handles[0])
-    return user_profile_info
-
-
-def parse_publication_date(tag_with_date):
-    publish_date = tag_with_date.get_text()
-    days_ago = int(publish_date.split(" ")[0])
-    post_date = datetime.today() - timedelta(days=days_ago)
-    return str(post_date.date())
-
-
-def parse_comment_number(post, xpath_templates):
-    comments_number = post.select_one(xpath_templates["comments_number_inside_post"]).find_all(recursive=False)[-1]
-    comments_number = comments_number.select("a > span")
-
-    # Representation may have distinct html formats
-    if len(comments_number) == 1:
-        return comments_number[0].get_text().split(" ")[0]
-    else:
-        return comments_number[0].select_one("div").find_all(recursive=False)[-1].get_text()
-
-
 def hover_current_post_element(browser, element):
     hover = webdriver.ActionChains(browser).move_to_element(element)
     hover.perform()
 
 
-def parse_main_page(current_post_info, post, post_id, logger, xpath_templates):
-    current_post_info["votes_number"] = post.select_one(xpath_templates["votes_number_inside_post"]).get_text()
-
-    top_post_html_source = post.select_one(xpath_templates["top_post_line_block"]).findChildren(recursive=False)[0]
-    if top_post_html_source.name == "article":
-        top_post_html_source = top_post_html_source.select_one(xpath_templates["article_shell"])
-    else:
-        top_post_html_source = top_post_html_source.select_one(xpath_templates["div_shell"])
-
-    all_a_tags_inside_block = top_post_html_source.find_all("a")
-    current_post_info["post_url"] = all_a_tags_inside_block[-1]["href"]
-    current_post_info["post_category"] = top_post_html_source.select_one(xpath_templates["post_category"])\
-        .get_text().lstrip("r/")
-
-    # User deleted
-    if len(all_a_tags_inside_block) == 2:
-        logger.debug(f"The post (post_id: {post_id}, url: {current_post_info['post_url']}) "
-                     f"exists, but the user has been deleted!")
-        return None
-
-    name_parse_string = all_a_tags_inside_block[1]
-    current_post_info["username"] = name_parse_string.get_text().lstrip("u/")
-    current_post_info["post_date"] = parse_publication_date(all_a_tags_inside_block[-1])
-    current_post_info["comments_number"] = parse_comment_number(post, xpath_templates)
-    user_page_url = "".join(["https://www.reddit.com", name_parse_string["href"]])
-
-    return user_page_url
-
-
-async def parse_user_page(browser, user_page_url, current_post, logger, xpath_templates):
-    user_profile_info = await get_user_html_from_new_browser_tab(browser, user_page_url, xpath_templates)
-    try:
-        current_post["user_karma"] = user_profile_info.select_one(xpath_templates["user_karma"]).get_text()
-        user_cake_day = dateparser.parse(user_profile_info
-                                         .select_one(xpath_templates["user_cake_day"])
-                                         .get_text())
-
-        current_post["user_cake_day"] = str(user_cake_day.date())
-    except AttributeError:
-        logger.debug(f"Failed to access user(link: {user_page_url}) page due to age limit!")
-
-        return False, current_post
-
-    return True, current_post
-
-
 def navigate_popup_menu(browser, post_id, current_post_info, logger):
     popup_menu = browser.find_element_by_id(f"UserInfoTooltip--{post_id}")
     popup_menu = popup_menu.find_element_by_xpath("..")
@@ -188,34 +107,46 @@ def parse_popup_menu(current_post_info, popup_element):
     current_post_info["comment_karma"] = tags_with_numbers[2].select_one("div").get_text()
 
 
-async def start_user_parsing(browser, source, current_post, logger, xpath_templates):
-    return await asyncio.gather(*[parse_user_page(browser, url, value, logger, xpath_templates)
-                                  for url, value in zip(source, current_post)])
+def create_profile_fetcher(fetcher: str, browser, concurrency: int, logger: logging.Logger):
+    if fetcher == "browser":
+        return BrowserProfileFetcher(browser)
+
+    return HttpProfileFetcher(concurrency, logger=logger)
+
+
+async def start_user_parsing(fetcher, source, current_post, logger, selectors: CompiledSelectors):
+    user_pages = await fetcher.fetch_all(source)
+    return [(parse_user_page(get_profile_block(user_page_html, selectors), url, value, logger, selectors), value)
+            for user_page_html, url, value in zip(user_pages, source, current_post)]
 
 
 def parse_reddit_page(chrome_drive_path: str, post_count: int, logger: logging.Logger,
-                      xpath_templates: Dict[str, str]) -> None:
+                      xpath_templates: Dict[str, str], batch_sending: bool = False, fetcher: str = "http",
+                      concurrency: int = 8, profile_cache: ProfileCache = None) -> None:
     filename = generate_filename()
     truncate_file_content(filename)
     logger.info(f"The filename: {filename}!")
     browser = config_browser(chrome_drive_path)
+    profile_fetcher = create_profile_fetcher(fetcher, browser, concurrency, logger)
+    selectors = CompiledSelectors(xpath_templates)
+    profile_cache = profile_cache or ProfileCache()
     parsed_information = []
     user_source, saved_dicts = [], []
 
     try:
         browser.get("https://www.reddit.com/top/?t=month")
+        feed = PostFeed(browser, xpath_templates)
         total_posts_count, addition_counter = 0, 0
 
         while len(parsed_information) < post_count:
             current_post_info = {}
-            single_posts = get_posts_list(browser.page_source, xpath_templates)
-            post = single_posts[total_posts_count]
-            post_id = post["id"]
+            post = feed[total_posts_count]
+            post_id = post.get("id")
 
             current_post = browser.find_element_by_id(post_id)
             hover_current_post_element(browser, current_post)
 
-            user_page_url = parse_main_page(current_post_info, post, post_id, logger, xpath_templates)
+            user_page_url = parse_main_page(current_post_info, post, post_id, logger, selectors)
             if user_page_url is None:
                 total_posts_count += 1
                 continue
@@ -226,14 +157,22 @@ def parse_reddit_page(chrome_drive_path: str, post_count: int, logger: logging.L
                 continue
 
             total_posts_count += 1
+            user_profile = profile_cache.get(username_from_url(user_page_url))
+            if user_profile is not None:
+                current_post_info.update(user_profile)
+                current_post_info["unique_id"] = generate_uuid()
+                parsed_information.append(current_post_info)
+                continue
+
             addition_counter += 1
             user_source.append(user_page_url), saved_dicts.append(current_post_info)
             if addition_counter == 10:
-                result = asyncio.run(start_user_parsing(browser, user_source, saved_dicts, logger, xpath_templates))
+                result = asyncio.run(start_user_parsing(profile_fetcher, user_source, saved_dicts, logger, selectors))
                 true_results = 0
-                for return_value, saved_dictionary in result:
+                for (return_value, saved_dictionary), user_page_url in zip(result, user_source):
                     if return_value is True:
                         true_results += 1
+                        profile_cache.put(username_from_url(user_page_url), saved_dictionary)
                         saved_dictionary["unique_id"] = generate_uuid()
                         parsed_information.append(saved_dictionary)
                         logger.debug(
@@ -248,7 +187,9 @@ def parse_reddit_page(chrome_drive_path: str, post_count: int, logger: logging.L
         logger.error(exception, exc_info=True)
     finally:
         browser.quit()
-        asyncio.run(start_sending(parsed_information[:post_count]))
+        profile_cache.save()
+        logger.info(profile_cache.summary())
+        asyncio.run(start_sending(parsed_information[:post_count], batch_sending))
 
 
 async def send_data(url, session, post):
@@ -256,11 +197,14 @@ async def send_data(url, session, post):
         return await response.read()
 
 
-async def start_sending(parsed_information):
+async def start_sending(parsed_information, batch_sending=False):
     url = "http://localhost:8087/posts/"
     tasks = []
 
     async with aiohttp.ClientSession() as session:
+        if batch_sending:
+            return await send_data(f"{url}batch", session, parsed_information)
+
         for post in parsed_information:
             task = asyncio.ensure_future(send_data(url, session, post))
             tasks.append(task)
@@ -268,7 +212,7 @@ async def start_sending(parsed_information):
         await asyncio.gather(*tasks)
 
 
-def parse_command_line_arguments() -> Tuple[str, str, int]:
+def parse_command_line_arguments() -> Tuple[str, str, int, bool, str, int, str, float]:
     argument_parser = argparse.ArgumentParser(description="Reddit parser")
     argument_parser.add_argument("--path", metavar="path", type=str, help="Chromedriver path",
                                  default=find_chrome_driver())
@@ -277,9 +221,21 @@ def parse_command_line_arguments() -> Tuple[str, str, int]:
                                  help="Minimal logging level('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')")
     argument_parser.add_argument("--post_count", metavar="post_count", type=int, default=15,
                                  choices=range(0, 101), help="Parsed post count")
+    argument_parser.add_argument("--batch", action="store_true",
+                                 help="Send all parsed posts in a single request to the batch endpoint")
+    argument_parser.add_argument("--fetcher", metavar="fetcher", type=str, default="http", choices=["http", "browser"],
+                                 help="How user pages are loaded, concurrent requests or tabs of the browser"
+                                      "('http', 'browser')")
+    argument_parser.add_argument("--concurrency", metavar="concurrency", type=int, default=8,
+                                 help="User pages fetched at the same time over http")
+    argument_parser.add_argument("--profile_cache", metavar="profile_cache", type=str, default="profile_cache.json",
+                                 help="File keeping parsed user pages between runs")
+    argument_parser.add_argument("--profile_ttl", metavar="profile_ttl", type=float, default=86400,
+                                 help="Seconds a parsed user page is reused before it is loaded again")
     args = argument_parser.parse_args()
 
-    return args.path, args.log_level, args.post_count
+    return args.path, args.log_level, args.post_count, args.batch, args.fetcher, args.concurrency, \
+        args.profile_cache, args.profile_ttl
 
 
 def find_chrome_driver() -> str:
@@ -295,13 +251,15 @@ def load_xpath_templates_from_json():
 
 
 if __name__ == "__main__":
-    chrome_driver, min_log_level, max_post_count = parse_command_line_arguments()
+    chrome_driver, min_log_level, max_post_count, batch, profile_fetcher_name, fetch_concurrency, \
+        profile_cache_filename, profile_ttl = parse_command_line_arguments()
     configured_logger = config_logger(string_to_logging_level(min_log_level))
     xpath = load_xpath_templates_from_json()
 
     if os.path.isfile(chrome_driver):
         start = time.time()
-        parse_reddit_page(chrome_driver, max_post_count, configured_logger, xpath)
+        parse_reddit_page(chrome_driver, max_post_count, configured_logger, xpath, batch, profile_fetcher_name,
+                          fetch_concurrency, ProfileCache(profile_cache_filename, profile_ttl))
         print(time.time() - start, " seconds.")
     else:
         configured_logger.error(f"Chrome drive does not exists at this link: {chrome_driver}!")
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from http import HTTPStatus
+from types import GeneratorType
+
+from endpoints import PostsEndpoints, parse_request_body, encode_json_body, body_allowed
+
+
+class RequestHeaders(dict):
+    """Case-insensitive headers, a lighter replacement for the email parser behind http.client.parse_headers"""
+
+    def get(self, name: str, default=None):
+        return super().get(name.lower(), default)
+
+    def __getitem__(self, name: str):
+        return super().__getitem__(name.lower())
+
+
+class AsyncRequestHandler(PostsEndpoints):
+    def __init__(self, command: str, path: str, request_version: str, headers: RequestHeaders):
+        self.command = command
+        self.path = path
+        self.request_version = request_version
+        self.headers = headers
+
+    def keep_alive(self) -> bool:
+        connection = self.headers.get("Connection", "").lower()
+        if self.request_version == "HTTP/1.0":
+            return connection == "keep-alive"
+
+        return connection != "close"
+
+
+async def read_request(reader: asyncio.StreamReader) -> tuple:
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None, None
+
+    command, path, request_version = request_line.decode("latin-1").split()
+    headers = RequestHeaders()
+    while True:
+        header = await reader.readline()
+        if header in (b"\r\n", b"\n", b""):
+            break
+        name, value = header.decode("latin-1").split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+
+    raw_body = await reader.readexactly(int(headers.get("Content-Length", 0)))
+    return AsyncRequestHandler(command, path, request_version, headers), raw_body
+
+
+def response_head(status_code: int, name: str, headers: dict) -> bytes:
+    lines = [f"HTTP/1.1 {status_code} {name}"] + [f"{header}: {value}" for header, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def run_blocking(offload: bool, function, *args):
+    """Call function in a thread of the default executor when it may block, so the event loop keeps serving"""
+    if not offload:
+        return function(*args)
+
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+async def write_response(writer: asyncio.StreamWriter, handler: AsyncRequestHandler, keep_alive: bool, offload: bool,
+                         status_code: int, name: str, body=None, extra_headers=None) -> bool:
+    """Write the response, returns whether the connection can serve another request"""
+    headers = {"Content-Type": "application/json", **(extra_headers or {})}
+    if not keep_alive:
+        headers["Connection"] = "close"
+
+    if not isinstance(body, GeneratorType):
+        encoded_body = encode_json_body(body) if body_allowed(status_code) else b""
+        if body_allowed(status_code):
+            headers["Content-Length"] = str(len(encoded_body))
+        writer.write(response_head(status_code, name, headers) + encoded_body)
+        await writer.drain()
+        handler.record_request(status_code, len(encoded_body))
+        return keep_alive
+
+    # HTTP/1.0 clients know nothing about chunks, for them the end of the body is the end of the connection
+    chunked = handler.request_version != "HTTP/1.0"
+    if chunked:
+        headers["Transfer-Encoding"] = "chunked"
+    else:
+        headers["Connection"] = "close"
+
+    writer.write(response_head(status_code, name, headers))
+    body_size = 0
+    # Chunks are made while the body is written, pulling the next one may call the cache
+    while True:
+        chunk = await run_blocking(offload, next, body, None)
+        if chunk is None:
+            break
+
+        if chunk:
+            body_size += len(chunk)
+            writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+            await writer.drain()
+
+    if chunked:
+        writer.write(b"0\r\n\r\n")
+    await writer.drain()
+    handler.record_request(status_code, body_size)
+    return keep_alive and chunked
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, idle_timeout: float,
+                            offload: bool) -> None:
+    try:
+        keep_alive = True
+        while keep_alive:
+            try:
+                handler, raw_body = await asyncio.wait_for(read_request(reader), idle_timeout)
+            except ValueError:
+                writer.write(response_head(HTTPStatus.BAD_REQUEST.value, HTTPStatus.BAD_REQUEST.phrase,
+                                           {"Content-Length": "0", "Connection": "close"}))
+                break
+
+            if handler is None:
+                break
+
+            request_body = parse_request_body(handler.headers, raw_body) if handler.command in ("POST", "PUT") else None
+            logging.info(f"{handler.command} request, Path: {handler.path}")
+            response = await run_blocking(offload, handler.dispatch_request, request_body)
+            keep_alive = await write_response(writer, handler, handler.keep_alive(), offload, *response)
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_async(port: int, idle_timeout: float, reuse_port: bool = False, offload: bool = False) -> None:
+    """Serve on the event loop, with `offload` the endpoints run in threads as their cache calls block"""
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(reader, writer, idle_timeout, offload),
+                                        port=port, reuse_port=reuse_port)
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,142 @@
+import threading
+from collections import OrderedDict
+
+
+class BoundedPosts:
+    """Posts of the cache held in memory up to max_posts entries or max_bytes, the least recently used ones are
+    read back from the storage engine when asked for again.
+
+    A post changed since the last compaction may exist nowhere else on disk but in the log, so it is pinned in
+    memory until a compaction covering it is done and may keep the store above its limits until then.
+    """
+
+    def __init__(self, storage, max_posts=None, max_bytes=None):
+        self.storage = storage
+        self.max_posts = max_posts
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._ids = set()
+        # unique_id -> (post, size), least recently used first
+        self._resident = OrderedDict()
+        # unique_id -> (post, size, change number) of the posts the snapshot does not have yet
+        self._pinned = {}
+        self._bytes = 0
+        # Numbers every change, a snapshot releases the pinned posts up to the number it was started at
+        self.changes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, unique_id):
+        return unique_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(list(self._ids))
+
+    def get(self, unique_id, default=None):
+        with self._lock:
+            entry = self._pinned.get(unique_id) or self._resident.get(unique_id)
+            if entry is not None:
+                if unique_id in self._resident:
+                    self._resident.move_to_end(unique_id)
+                self.hits += 1
+                return entry[0]
+
+            if unique_id not in self._ids:
+                return default
+
+            self.misses += 1
+            changes = self.changes
+
+        post = self.storage.read_post(unique_id)
+        if post is None:
+            return default
+
+        with self._lock:
+            # Anything changed during the read may have made the copy from disk stale, it is not kept then.
+            # Another reader missing the same post may have put it back first, it is not counted twice then
+            if self.changes == changes and unique_id not in self._pinned and unique_id not in self._resident:
+                self._resident[unique_id] = (post, post.memory_size())
+                self._bytes += self._resident[unique_id][1]
+                self._evict()
+
+        return post
+
+    def load(self, unique_id, post):
+        """Add a post read from the snapshot, it can be evicted right away"""
+        with self._lock:
+            self._ids.add(unique_id)
+            self._discard(unique_id)
+            self._resident[unique_id] = (post, post.memory_size())
+            self._bytes += self._resident[unique_id][1]
+            self._evict()
+
+    def __setitem__(self, unique_id, post):
+        with self._lock:
+            self.changes += 1
+            self._ids.add(unique_id)
+            self._discard(unique_id)
+            self._pinned[unique_id] = (post, post.memory_size(), self.changes)
+            self._bytes += self._pinned[unique_id][1]
+            self._evict()
+
+    def pop(self, unique_id, default=None):
+        post = self.get(unique_id)
+        with self._lock:
+            if unique_id not in self._ids:
+                return default
+
+            self.changes += 1
+            self._ids.discard(unique_id)
+            self._discard(unique_id)
+
+        return post
+
+    def items(self):
+        """Resident posts first, then the rest streamed from the storage engine"""
+        with self._lock:
+            in_memory = [(unique_id, entry[0]) for unique_id, entry in self._pinned.items()]
+            in_memory += [(unique_id, entry[0]) for unique_id, entry in self._resident.items()]
+
+        yield from in_memory
+        seen_ids = {unique_id for unique_id, _ in in_memory}
+        for post in self.storage.iterate_posts():
+            if post["unique_id"] in self._ids and post["unique_id"] not in seen_ids:
+                yield post["unique_id"], post
+
+    def values(self):
+        return (post for _, post in self.items())
+
+    def release(self, changes):
+        """Unpin the posts changed up to the given change number, a snapshot holding them has been written"""
+        with self._lock:
+            for unique_id, (post, size, change) in list(self._pinned.items()):
+                if change <= changes:
+                    del self._pinned[unique_id]
+                    self._resident[unique_id] = (post, size)
+            self._evict()
+
+    def statistics(self):
+        with self._lock:
+            return {"posts": len(self._ids), "posts_in_memory": len(self._pinned) + len(self._resident),
+                    "pinned_posts": len(self._pinned), "bytes_in_memory": self._bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def _discard(self, unique_id):
+        entry = self._pinned.pop(unique_id, None) or self._resident.pop(unique_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _evict(self):
+        while self._resident and self._over_limit():
+            _, (_, size) = self._resident.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def _over_limit(self):
+        posts = len(self._pinned) + len(self._resident)
+        return (self.max_posts is not None and posts > self.max_posts) or \
+            (self.max_bytes is not None and self._bytes > self.max_bytes)
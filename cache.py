@@ -1,72 +1,388 @@
-from datetime import datetime
+import bisect
+import logging
+import threading
+import time
+import uuid
 
-from file_management import get_all_posts, save_all_posts, generate_filename
+from bounded_posts import BoundedPosts
+from file_management import LOG_APPEND, LOG_MODIFY, LOG_DELETE
+from metrics import registry
+from post_record import PostRecord
+from post_statistics import PostStatistics
+from storage import TextStorage
 
-
-def check_backup(function):
-    def inner_function(self, *args):
-        if datetime_difference(self._last_backup, datetime.now()) > self._backup_period:
-            self.backup_cache()
-
-        return function(self, *args)
-
-    return inner_function
+INDEXED_FIELDS = ("username", "post_category", "post_date")
 
 
 class Cache:
-    def __init__(self):
-        self.filename = generate_filename()
-        self._last_backup = datetime.now()
-        self._backup_period = 2
+    def __init__(self, lock_stripes=16, max_posts=None, max_bytes=None, storage=None):
+        # Engine the posts are persisted with, the text files of the current day unless told otherwise
+        self._storage = storage or TextStorage()
         self._cache_modified = False
         self._cached_data = {}
+        # Without limits every post stays in memory, with them only the recently used ones do
+        self._bounded = max_posts is not None or max_bytes is not None
+        self._max_posts = max_posts
+        self._max_bytes = max_bytes
+        self._compaction_lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._log_file_lock = threading.Lock()
+        self._pending_log_records = []
+        self._flusher = None
+        self._flush_requested = threading.Event()
+        self._stop_flusher = threading.Event()
+        self._flush_interval = 1
+        self._dirty_threshold = 1000
+        self._compaction_interval = 120
+        # Writers of different posts rarely share a stripe, readers never take a lock at all
+        self._stripe_locks = [threading.Lock() for _ in range(lock_stripes)]
+        # Sorted unique ids give pagination a cursor that stays valid while posts come and go. Writers only note the
+        # ids they add or remove, the next page request merges them in, so no write pays for keeping the order
+        self._sorted_ids = []
+        self._added_ids = set()
+        self._removed_ids = set()
+        self._order_lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        # field -> value -> ids of the posts having it
+        self._indexes = {field: {} for field in INDEXED_FIELDS}
+        self._index_lock = threading.Lock()
+        self._statistics = PostStatistics()
+        # Bumped by every mutation, the instance token keeps versions of different runs apart
+        self._instance_token = uuid.uuid4().hex[:8]
+        self._version = 0
 
         self.load_cache()
 
     def load_cache(self):
-        all_posts = get_all_posts(self.filename)
-        for post in all_posts:
-            self._cached_data[post["unique_id"]] = post
+        if self._bounded:
+            self._cached_data = BoundedPosts(self._storage, self._max_posts, self._max_bytes)
+            for post in self._storage.iterate_posts():
+                self._cached_data.load(post["unique_id"], post)
+        else:
+            self._cached_data = {post["unique_id"]: post for post in self._storage.iterate_posts()}
+
+        for operation, unique_id, post in self._storage.read_log_records():
+            if operation == LOG_DELETE:
+                self._cached_data.pop(unique_id, None)
+            else:
+                self._cached_data[unique_id] = post
+
+        self._sorted_ids = sorted(self._cached_data)
+        for unique_id, post in self._cached_data.items():
+            self._index_post(unique_id, post)
+            self._statistics.add(post)
+
+    def start_flusher(self, flush_interval=1, dirty_threshold=1000, compaction_interval=120):
+        """Move all disk work to a background thread, request threads only queue log records in memory"""
+        self._flush_interval = flush_interval
+        self._dirty_threshold = dirty_threshold
+        self._compaction_interval = compaction_interval
+        self._stop_flusher.clear()
+        self._flusher = threading.Thread(target=self._run_flusher, name="cache-flusher", daemon=True)
+        self._flusher.start()
+
+    def stop_flusher(self, timeout=10):
+        """Write the queued log records, then give the final compaction at most timeout seconds"""
+        self._flush_safely()
+        if self._flusher is None:
+            return
+
+        self._stop_flusher.set()
+        self._flush_requested.set()
+        self._flusher.join(timeout)
+        if self._flusher.is_alive():
+            # Unfinished compaction never replaces the snapshot, the logs are replayed on the next start
+            logging.warning(f"Cache compaction did not finish in {timeout} seconds")
+        self._flusher = None
+
+    def _run_flusher(self):
+        last_compaction = time.monotonic()
+        while not self._stop_flusher.is_set():
+            self._flush_requested.wait(self._flush_interval)
+            self._flush_requested.clear()
+            # A failed write or compaction is tried again on the next round, the thread must not die of it
+            self._flush_safely()
+
+            if time.monotonic() - last_compaction >= self._compaction_interval:
+                self._backup_safely()
+                last_compaction = time.monotonic()
+
+        self._flush_safely()
+        self._backup_safely()
+
+    def _flush_safely(self):
+        try:
+            self.flush_log()
+        except Exception as exception:
+            logging.error(f"Cache log flush failed, records stay queued: {exception!r}", exc_info=True)
+
+    def _backup_safely(self):
+        try:
+            self.backup_cache()
+        except Exception as exception:
+            logging.error(f"Cache compaction failed: {exception!r}", exc_info=True)
+
+    def flush_log(self):
+        with self._log_file_lock:
+            self._write_pending_log_records()
+
+    def _write_pending_log_records(self):
+        # Only the swap happens under the lock shared with request threads, the write does not
+        with self._log_lock:
+            pending_log_records, self._pending_log_records = self._pending_log_records, []
+
+        if not pending_log_records:
+            return
+
+        try:
+            self._storage.write_log_records(pending_log_records)
+        except Exception:
+            # Back in front of the records queued meanwhile, so that the order of changes is kept
+            with self._log_lock:
+                self._pending_log_records[:0] = pending_log_records
+            raise
 
     def backup_cache(self):
-        if self._cache_modified:
-            save_all_posts(self.filename, self._cached_data)
-            self._last_backup = datetime.now()
-            self._cache_modified = False
+        with self._compaction_lock:
+            if not self._cache_modified:
+                return
+
+            start = time.perf_counter()
+            with self._log_file_lock:
+                self._cache_modified = False
+                # Every change made so far is in the snapshot below
+                changes = self._cached_data.changes if self._bounded else 0
+                try:
+                    self._write_pending_log_records()
+                    compaction = self._storage.start_compaction()
+                except Exception:
+                    self._cache_modified = True
+                    raise
+
+            if not self._storage.snapshot_required:
+                posts = None
+            elif self._bounded:
+                # Posts out of memory are streamed from the previous snapshot
+                posts = self._cached_data
+            else:
+                posts = dict(self._cached_data)
+
+            try:
+                size = self._storage.finish_compaction(posts, compaction)
+            except Exception:
+                # Rotated logs are replayed on the next start, the next compaction writes the snapshot again
+                self._cache_modified = True
+                raise
+
+            if self._bounded:
+                self._cached_data.release(changes)
+            registry.observe("cache_backup_duration_seconds", time.perf_counter() - start)
+            registry.set_gauge("cache_backup_size_bytes", size)
+
+    def _stripe_index(self, unique_id):
+        return hash(unique_id) % len(self._stripe_locks)
+
+    def _stripe_lock(self, unique_id):
+        return self._stripe_locks[self._stripe_index(unique_id)]
+
+    def _write_log(self, operation, unique_id, post=None):
+        self._write_log_records([(operation, unique_id, post)])
+
+    def _write_log_records(self, records):
+        if not records:
+            return
+
+        with self._log_lock:
+            self._pending_log_records.extend(records)
+            self._version += 1
+            self._cache_modified = True
+            if len(self._pending_log_records) >= self._dirty_threshold:
+                self._flush_requested.set()
 
-    @check_backup
     def get_post_by_id(self, unique_id):
         return self._cached_data.get(unique_id)
 
-    @check_backup
     def get_all_posts(self):
         return list(self._cached_data.values())
 
-    @check_backup
+    def get_posts_page(self, cursor=None, limit=100, filters=None):
+        """Return up to limit posts following the cursor id and the cursor of the next page, None on the last one"""
+        if filters:
+            page_ids, has_next_page = page_of_ids(self.find_ids(filters), cursor, limit)
+        else:
+            page_ids, has_next_page = page_of_ids(self._ordered_ids(), cursor, limit)
+
+        posts = [post for post in map(self._cached_data.get, page_ids) if post is not None]
+        if filters:
+            posts = [post for post in posts if matches_filters(post, filters)]
+
+        return posts, page_ids[-1] if has_next_page else None
+
+    def iterate_pages(self, page_size=100, filters=None):
+        cursor = None
+        while True:
+            posts, cursor = self.get_posts_page(cursor, page_size, filters)
+            yield posts
+            if cursor is None:
+                break
+
+    def find_ids(self, filters):
+        """Sorted ids of the posts whose indexed fields have all the given values"""
+        with self._index_lock:
+            id_sets = sorted((self._indexes[field].get(value, set()) for field, value in filters.items()), key=len)
+            matching_ids = id_sets[0].intersection(*id_sets[1:])
+
+        return sorted(matching_ids)
+
+    def find_posts(self, filters):
+        # Index and posts are updated one after another, a post changed in between is checked once more
+        posts = map(self._cached_data.get, self.find_ids(filters))
+        return [post for post in posts if post is not None and matches_filters(post, filters)]
+
+    def _index_post(self, unique_id, post):
+        with self._index_lock:
+            for field in INDEXED_FIELDS:
+                self._indexes[field].setdefault(post.get(field), set()).add(unique_id)
+
+    def _unindex_post(self, unique_id, post):
+        with self._index_lock:
+            for field in INDEXED_FIELDS:
+                unique_ids = self._indexes[field].get(post.get(field))
+                if unique_ids is not None:
+                    unique_ids.discard(unique_id)
+                    if not unique_ids:
+                        del self._indexes[field][post.get(field)]
+
+    def _ordered_ids(self):
+        """Sorted ids of the cache, the list is replaced rather than changed, so it can be read without a lock"""
+        with self._merge_lock:
+            # Writers wait only for the swap, not for the merge
+            with self._order_lock:
+                added_ids, self._added_ids = self._added_ids, set()
+                removed_ids, self._removed_ids = self._removed_ids, set()
+
+            if added_ids or removed_ids:
+                sorted_ids = [unique_id for unique_id in self._sorted_ids if unique_id not in removed_ids] \
+                    if removed_ids else self._sorted_ids
+                # Two sorted runs, which sorted merges in linear time
+                self._sorted_ids = sorted(sorted_ids + sorted(added_ids))
+
+            return self._sorted_ids
+
+    def _post_added(self, unique_id, post):
+        with self._order_lock:
+            # Removed and added again before a merge, the id is still in the sorted list
+            if unique_id in self._removed_ids:
+                self._removed_ids.discard(unique_id)
+            else:
+                self._added_ids.add(unique_id)
+        self._index_post(unique_id, post)
+        self._statistics.add(post)
+
+    def _post_removed(self, unique_id, post):
+        with self._order_lock:
+            if unique_id in self._added_ids:
+                self._added_ids.discard(unique_id)
+            else:
+                self._removed_ids.add(unique_id)
+        self._unindex_post(unique_id, post)
+        self._statistics.remove(post)
+
+    def _post_replaced(self, unique_id, old_post, new_post):
+        self._unindex_post(unique_id, old_post)
+        self._index_post(unique_id, new_post)
+        self._statistics.remove(old_post)
+        self._statistics.add(new_post)
+
     def append(self, unique_id, post):
-        self._cached_data[unique_id] = post
-        self._cache_modified = True
+        post = PostRecord.from_mapping(post, unique_id)
+        with self._stripe_lock(unique_id):
+            if unique_id in self._cached_data:
+                return False
+
+            self._cached_data[unique_id] = post
+            self._post_added(unique_id, post)
+            self._write_log(LOG_APPEND, unique_id, post)
+            return True
+
+    def append_many(self, posts):
+        """Append (unique_id, post) pairs as one operation, returns for each pair whether it was created"""
+        # Converted before any lock is taken, a post that cannot be stored fails the batch before anything changed
+        posts = [(unique_id, PostRecord.from_mapping(post, unique_id)) for unique_id, post in posts]
+        # Stripes are always taken in the same order, so two batches can never deadlock
+        stripe_indexes = sorted({self._stripe_index(unique_id) for unique_id, _ in posts})
+        for stripe_index in stripe_indexes:
+            self._stripe_locks[stripe_index].acquire()
+
+        try:
+            results, log_records = [], []
+            for unique_id, post in posts:
+                created = unique_id not in self._cached_data
+                if created:
+                    self._cached_data[unique_id] = post
+                    self._post_added(unique_id, post)
+                    log_records.append((LOG_APPEND, unique_id, post))
+                results.append(created)
+
+            self._write_log_records(log_records)
+        finally:
+            for stripe_index in stripe_indexes:
+                self._stripe_locks[stripe_index].release()
+
+        return results
 
-    @check_backup
     def delete(self, unique_id):
-        post = self._cached_data.pop(unique_id, None)
-        if not post:
-            self._cache_modified = True
+        with self._stripe_lock(unique_id):
+            post = self._cached_data.pop(unique_id, None)
+            if post:
+                self._post_removed(unique_id, post)
+                self._write_log(LOG_DELETE, unique_id)
 
-        return post
+            return post
 
-    @check_backup
     def modify(self, unique_id, post):
-        self._cached_data[unique_id] = post
-        self._cache_modified = True
+        post = PostRecord.from_mapping(post, unique_id)
+        with self._stripe_lock(unique_id):
+            old_post = self._cached_data.get(unique_id)
+            if old_post is None:
+                return False
+
+            self._cached_data[unique_id] = post
+            self._post_replaced(unique_id, old_post, post)
+            self._write_log(LOG_MODIFY, unique_id, post)
+            return True
+
+    def statistics(self):
+        return self._statistics.snapshot()
+
+    def memory_statistics(self):
+        """Hit, miss and eviction counters of a bounded cache, None when every post is kept in memory"""
+        return self._cached_data.statistics() if self._bounded else None
+
+    def update_metrics(self):
+        """Set the metrics describing the cache, they are read from it only when the metrics are rendered"""
+        registry.set_gauge("cache_posts", self.cache_size())
+        memory_statistics = self.memory_statistics()
+        if memory_statistics is not None:
+            registry.set_gauge("cache_posts_in_memory", memory_statistics["posts_in_memory"])
+            registry.set_gauge("cache_bytes_in_memory", memory_statistics["bytes_in_memory"])
+            for counter in ("hits", "misses", "evictions"):
+                registry.set_counter(f"cache_{counter}_total", memory_statistics[counter])
+
+    def data_version(self):
+        return f"{self._instance_token}-{self._version}"
 
     def cache_size(self):
         return len(self._cached_data)
 
 
-def datetime_difference(first_date, second_date):
-    difference = second_date - first_date
-    return difference.total_seconds() / 60
+def page_of_ids(ordered_ids, cursor, limit):
+    start = bisect.bisect_right(ordered_ids, cursor) if cursor else 0
+    return ordered_ids[start:start + limit], start + limit < len(ordered_ids)
+
+
+def matches_filters(post, filters):
+    return all(post.get(field) == value for field, value in filters.items())
 
 
 if __name__ == '__main__':
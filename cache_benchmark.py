@@ -0,0 +1,200 @@
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Dict
+
+from cache import Cache
+from post_record import PostRecord
+from storage import create_storage, STORAGE_ENGINES
+from file_management import (
+    LOG_APPEND, get_post_information_sequence, serialize_post_data, deserialize_post_data, iterate_posts
+)
+
+
+def generate_post(unique_id: str, revision: int = 0) -> Dict[str, str]:
+    post = {field: f"{field}-{revision}" for field in get_post_information_sequence()}
+    post["unique_id"] = unique_id
+    return post
+
+
+def generate_scraped_post(unique_id: str, randomizer: random.Random) -> Dict[str, str]:
+    """Post with values shaped like the ones the crawler scrapes: some counters plain, some abbreviated"""
+    def counter():
+        value = randomizer.randint(0, 200000)
+        return str(value) if value < 1000 else f"{value / 1000:.1f}k"
+
+    return {
+        "unique_id": unique_id,
+        "post_url": f"https://www.reddit.com/r/category{randomizer.randint(0, 50)}/comments/{unique_id[:6]}/",
+        "username": f"user{randomizer.randint(0, 100000)}",
+        "user_karma": str(randomizer.randint(0, 10 ** 6)),
+        "user_cake_day": f"20{randomizer.randint(10, 20)}-0{randomizer.randint(1, 9)}-1{randomizer.randint(0, 9)}",
+        "post_karma": str(randomizer.randint(0, 10 ** 5)),
+        "comment_karma": str(randomizer.randint(0, 10 ** 5)),
+        "post_date": f"2020-0{randomizer.randint(1, 9)}-1{randomizer.randint(0, 9)}",
+        "comments_number": counter(),
+        "votes_number": counter(),
+        "post_category": f"category{randomizer.randint(0, 50)}",
+    }
+
+
+def generate_unique_id(number: int) -> str:
+    return f"{number:032x}"
+
+
+def read_scaling(max_threads: int, reads: int) -> None:
+    cache = Cache()
+    unique_ids = [generate_unique_id(number) for number in range(10000)]
+    for unique_id in unique_ids:
+        cache.append(unique_id, generate_post(unique_id))
+
+    def read_posts():
+        for number in range(reads):
+            cache.get_post_by_id(unique_ids[number % len(unique_ids)])
+
+    threads = 1
+    while threads <= max_threads:
+        readers = [threading.Thread(target=read_posts) for _ in range(threads)]
+        start = time.perf_counter()
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        elapsed = time.perf_counter() - start
+        print(f"{threads:>3} readers: {threads * reads / elapsed:,.0f} reads/second")
+        threads *= 2
+
+
+def generate_posts_file(filename: str, posts: int) -> None:
+    with open(filename, "w") as file:
+        for number in range(posts):
+            unique_id = generate_unique_id(number)
+            file.write(f"{serialize_post_data(unique_id, generate_post(unique_id, number))}{os.linesep}")
+
+
+def load_with_readlines(filename: str) -> dict:
+    """The loader as it was before streaming: list of lines, then list of dicts, then the cache dict"""
+    with open(filename, "r") as file:
+        all_posts = [deserialize_post_data(post) for post in file.readlines()]
+
+    cached_data = {}
+    for post in all_posts:
+        cached_data[post["unique_id"]] = post
+
+    return cached_data
+
+
+def load_with_stream(filename: str) -> dict:
+    return {post["unique_id"]: post for post in iterate_posts(filename)}
+
+
+def measure_load(loader: str, filename: str) -> None:
+    loaders = {"readlines": load_with_readlines, "stream": load_with_stream}
+    start = time.perf_counter()
+    cached_data = loaders[loader](filename)
+    elapsed = time.perf_counter() - start
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{loader:>10}: {len(cached_data)} posts, {elapsed:.2f} seconds, peak RSS {peak_memory:.0f} MiB")
+
+
+def startup_benchmark(posts: int) -> None:
+    filename = os.path.abspath("startup.txt")
+    generate_posts_file(filename, posts)
+    print(f"Synthetic file: {posts} posts, {os.path.getsize(filename) / 2 ** 20:.0f} MiB")
+
+    # Peak RSS never goes down, so every loader gets a fresh interpreter
+    for loader in ("readlines", "stream"):
+        subprocess.run([sys.executable, os.path.abspath(__file__), "load", "--loader", loader, "--filename", filename],
+                       check=True)
+
+
+def memory_benchmark(posts: int) -> None:
+    """Memory taken by a store of posts as dicts of strings and as post records"""
+    randomizer = random.Random(0)
+    lines = [serialize_post_data(unique_id, generate_scraped_post(unique_id, randomizer))
+             for unique_id in map(generate_unique_id, range(posts))]
+    fields = ["unique_id"] + get_post_information_sequence()
+
+    def deserialize_as_dict(line):
+        return dict(zip(fields, line.split(";")))
+
+    for name, deserialize in (("dict", deserialize_as_dict), ("record", deserialize_post_data)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        store = {post["unique_id"]: post for post in map(deserialize, lines)}
+        elapsed = time.perf_counter() - start
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{name:>8}: {len(store)} posts, {size / posts:.0f} bytes per post, {elapsed:.2f} seconds to build")
+        del store
+
+
+def storage_benchmark(posts: int, batch_size: int = 1000, reads: int = 10000) -> None:
+    """Batched writes, compaction, single post reads and a full load for every storage engine"""
+    randomizer = random.Random(0)
+    records = [(LOG_APPEND, unique_id, PostRecord.from_mapping(generate_scraped_post(unique_id, randomizer)))
+               for unique_id in map(generate_unique_id, range(posts))]
+    read_ids = [randomizer.choice(records)[1] for _ in range(reads)]
+
+    for engine in STORAGE_ENGINES:
+        storage = create_storage(engine)
+        timings = []
+        start = time.perf_counter()
+        for batch_start in range(0, posts, batch_size):
+            storage.write_log_records(records[batch_start:batch_start + batch_size])
+        timings.append(("write", time.perf_counter() - start))
+
+        start = time.perf_counter()
+        size = storage.finish_compaction({unique_id: post for _, unique_id, post in records},
+                                         storage.start_compaction())
+        timings.append(("compact", time.perf_counter() - start))
+
+        start = time.perf_counter()
+        for unique_id in read_ids:
+            storage.read_post(unique_id)
+        timings.append((f"{reads} reads", time.perf_counter() - start))
+
+        start = time.perf_counter()
+        loaded_posts = sum(1 for _ in storage.iterate_posts())
+        timings.append((f"load {loaded_posts}", time.perf_counter() - start))
+
+        print(f"{engine:>8}: " + ", ".join(f"{name} {elapsed:.2f} s" for name, elapsed in timings) +
+              f", {size / 2 ** 20:.0f} MiB")
+
+
+def parse_command_line_arguments() -> argparse.Namespace:
+    argument_parser = argparse.ArgumentParser(description="Cache benchmarks")
+    argument_parser.add_argument("mode", choices=["read_scaling", "startup", "load", "memory", "storage"])
+    argument_parser.add_argument("--threads", metavar="threads", type=int, default=16)
+    argument_parser.add_argument("--operations", metavar="operations", type=int, default=20000)
+    argument_parser.add_argument("--posts", metavar="posts", type=int, default=1000000,
+                                 help="Posts in the synthetic file of the startup, memory and storage benchmarks")
+    argument_parser.add_argument("--loader", metavar="loader", type=str, choices=["readlines", "stream"])
+    argument_parser.add_argument("--filename", metavar="filename", type=str)
+    return argument_parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_command_line_arguments()
+    if arguments.mode == "load":
+        measure_load(arguments.loader, arguments.filename)
+        sys.exit()
+
+    # Cache always works with the file of the current day, keep it away from real data
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        if arguments.mode == "storage":
+            storage_benchmark(arguments.posts)
+        elif arguments.mode == "memory":
+            memory_benchmark(arguments.posts)
+        elif arguments.mode == "read_scaling":
+            read_scaling(arguments.threads, arguments.operations)
+        else:
+            startup_benchmark(arguments.posts)
@@ -0,0 +1,122 @@
+import logging
+import os
+import threading
+import time
+from multiprocessing.managers import BaseManager, BaseProxy
+from typing import Tuple
+
+from cache import Cache
+from metrics import registry
+
+
+class CacheProxy(BaseProxy):
+    """Cache of the primary process as seen from a worker, every call is a round trip over the manager connection"""
+
+    _exposed_ = ("get_post_by_id", "get_all_posts", "get_posts_page", "find_posts", "append", "append_many",
+                 "delete", "modify", "statistics", "memory_statistics", "update_metrics", "data_version", "cache_size")
+
+    def get_post_by_id(self, unique_id):
+        return self._callmethod("get_post_by_id", (unique_id,))
+
+    def get_all_posts(self):
+        return self._callmethod("get_all_posts")
+
+    def get_posts_page(self, cursor=None, limit=100, filters=None):
+        return self._callmethod("get_posts_page", (cursor, limit, filters))
+
+    def iterate_pages(self, page_size=100, filters=None):
+        # Generators do not cross processes, pages are pulled one call at a time instead
+        cursor = None
+        while True:
+            posts, cursor = self.get_posts_page(cursor, page_size, filters)
+            yield posts
+            if cursor is None:
+                break
+
+    def find_posts(self, filters):
+        return self._callmethod("find_posts", (filters,))
+
+    def append(self, unique_id, post):
+        return self._callmethod("append", (unique_id, post))
+
+    def append_many(self, posts):
+        return self._callmethod("append_many", (posts,))
+
+    def delete(self, unique_id):
+        return self._callmethod("delete", (unique_id,))
+
+    def modify(self, unique_id, post):
+        return self._callmethod("modify", (unique_id, post))
+
+    def statistics(self):
+        return self._callmethod("statistics")
+
+    def memory_statistics(self):
+        return self._callmethod("memory_statistics")
+
+    def update_metrics(self):
+        return self._callmethod("update_metrics")
+
+    def data_version(self):
+        return self._callmethod("data_version")
+
+    def cache_size(self):
+        return self._callmethod("cache_size")
+
+
+class MetricsProxy(BaseProxy):
+    """Metrics registry of the primary process, the workers merge theirs into it so that one scrape sees them all"""
+
+    _exposed_ = ("merge", "render")
+
+    def merge(self, source, snapshot):
+        return self._callmethod("merge", (source, snapshot))
+
+    def render(self):
+        return self._callmethod("render")
+
+
+class CacheManager(BaseManager):
+    pass
+
+
+def serve_cache(cache: Cache, address: str, authkey: bytes) -> None:
+    """Serve the cache and the metrics registry to the workers from a background thread, the calling process stays
+    the only writer of the cache"""
+    CacheManager.register("get_cache", callable=lambda: cache, proxytype=CacheProxy)
+    CacheManager.register("get_metrics", callable=lambda: registry, proxytype=MetricsProxy)
+    server = CacheManager(address=address, authkey=authkey).get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Serve cache on {address}")
+
+
+def connect_cache(address: str, authkey: bytes, attempts: int = 100) -> Tuple[CacheProxy, MetricsProxy]:
+    """Cache and metrics registry of the primary process"""
+    CacheManager.register("get_cache", proxytype=CacheProxy)
+    CacheManager.register("get_metrics", proxytype=MetricsProxy)
+    manager = CacheManager(address=address, authkey=authkey)
+    for _ in range(attempts):
+        try:
+            manager.connect()
+            return manager.get_cache(), manager.get_metrics()
+        except (FileNotFoundError, ConnectionRefusedError):
+            # Workers start alongside the primary process, its manager may not be listening yet
+            time.sleep(0.1)
+
+    raise ConnectionError(f"Cache manager on {address} is not available")
+
+
+def merge_metrics_periodically(metrics: MetricsProxy, interval: float = 1) -> None:
+    """Merge the metrics of this worker into the registry of the primary process every interval seconds from a
+    background thread, a scrape answered by any worker then counts the requests of all of them"""
+    def merge_metrics():
+        source = str(os.getpid())
+        while True:
+            time.sleep(interval)
+            try:
+                metrics.merge(source, registry.snapshot())
+            except (OSError, EOFError):
+                # Primary process is gone, the worker is about to be stopped as well
+                return
+
+    threading.Thread(target=merge_metrics, name="metrics-merger", daemon=True).start()
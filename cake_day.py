@@ -0,0 +1,25 @@
+import functools
+from datetime import datetime
+
+# Formats reddit shows the cake day in, read strictly before anything is left to dateparser
+CAKE_DAY_FORMATS = ("%B %d, %Y", "%b %d, %Y", "%d %B %Y", "%d %b %Y", "%Y-%m-%d", "%m/%d/%Y")
+
+
+# Unbounded, there are only so many days since reddit started
+@functools.lru_cache(maxsize=None)
+def parse_cake_day(text: str) -> str or None:
+    """Cake day as YYYY-MM-DD, None when the text is no date.
+
+    Every distinct text is parsed once, dateparser is imported on the first text none of the formats reads.
+    """
+    text = " ".join(text.split())
+    for date_format in CAKE_DAY_FORMATS:
+        try:
+            return str(datetime.strptime(text, date_format).date())
+        except ValueError:
+            continue
+
+    import dateparser
+
+    cake_day = dateparser.parse(text)
+    return None if cake_day is None else str(cake_day.date())
@@ -0,0 +1,203 @@
+import json
+import os
+import time
+from functools import partial
+from typing import Iterable, Iterator, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from cache import INDEXED_FIELDS
+from metrics import registry
+from post_record import json_default, has_valid_fields, is_field_value
+from url_processing import Router
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class PostsEndpoints:
+    """The /posts API shared by every server engine, the handler it is mixed into provides command, path, headers"""
+
+    # Posts per page of a paginated listing and per chunk of a streamed one
+    default_page_size = 100
+    # Created by the server once the limits of the cache are known
+    cache = None
+    # Registry the metrics are rendered from, the one of the primary process when serving as a worker
+    metrics = registry
+    # (etag, encoded body) of the last full listing, replaced as a whole so readers never see a torn pair
+    serialized_listing = (None, b"")
+    router = Router([
+        ("GET", r"/posts/?", "get_all_posts_request"),
+        ("GET", r"/posts/(?P<unique_id>[^/]{32})/?", "get_single_post_request"),
+        ("POST", r"/posts/?", "post_request"),
+        ("POST", r"/posts/batch/?", "batch_post_request"),
+        ("DELETE", r"/posts/(?P<unique_id>[^/]{32})/?", "delete_request"),
+        ("PUT", r"/posts/(?P<unique_id>[^/]{32})/?", "put_request"),
+        ("GET", r"/stats/?", "get_statistics_request"),
+        ("GET", r"/metrics/?", "get_metrics_request")
+    ])
+
+    def request_handler(self, command: str, uri: str):
+        url = urlsplit(uri)
+        self.query_parameters = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        handler_name, path_parameters = self.router.match(command, url.path)
+        # Label of the request in the metrics, the pattern behind it rather than the path keeps their number bounded
+        self.route = handler_name or "unmatched"
+        if handler_name is None:
+            return None
+
+        return partial(getattr(self, handler_name), **path_parameters)
+
+    def dispatch_request(self, request_body=None) -> tuple:
+        self.request_started = time.perf_counter()
+        method = self.request_handler(self.command, self.path)
+        if method is None:
+            return (200, "OK") if self.command == "POST" else (404, "Not Found")
+
+        if self.command in ("POST", "PUT"):
+            return method(request_body)
+
+        return method()
+
+    def record_request(self, status_code: int, response_size: int) -> None:
+        """Called by the engine once the response is written"""
+        route = (("route", self.route),)
+        registry.increment("http_requests_total", (("method", self.command),) + route + (("status", status_code),))
+        registry.observe("http_request_duration_seconds", time.perf_counter() - self.request_started, route)
+        registry.observe("http_request_size_bytes", int(self.headers.get("Content-Length", 0)), route)
+        registry.observe("http_response_size_bytes", response_size, route)
+
+    def not_modified(self, etag: str) -> bool:
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is None:
+            return False
+
+        return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+    def get_all_posts_request(self):
+        try:
+            limit = int(self.query_parameters.get("limit", self.default_page_size))
+        except ValueError:
+            return 400, "Bad Request"
+
+        if limit <= 0:
+            return 400, "Bad Request"
+
+        filters = {field: value for field, value in self.query_parameters.items() if field in INDEXED_FIELDS}
+        if self.query_parameters.get("stream") in ("1", "true"):
+            return 200, "OK", json_array_chunks(self.cache.iterate_pages(limit, filters))
+
+        # Taken before reading the posts, a change made meanwhile only makes the tag older than the body
+        etag = f'"{self.cache.data_version()}"'
+        if self.not_modified(etag):
+            return 304, "Not Modified", None, {"ETag": etag}
+
+        if "limit" in self.query_parameters or "cursor" in self.query_parameters:
+            posts, next_cursor = self.cache.get_posts_page(self.query_parameters.get("cursor"), limit, filters)
+            return 200, "OK", {"posts": posts, "next_cursor": next_cursor}, {"ETag": etag}
+
+        if filters:
+            return 200, "OK", self.cache.find_posts(filters), {"ETag": etag}
+
+        cached_etag, file_content = self.serialized_listing
+        if cached_etag != etag:
+            file_content = encode_json_body(self.cache.get_all_posts())
+            PostsEndpoints.serialized_listing = (etag, file_content)
+
+        return 200, "OK", file_content, {"ETag": etag}
+
+    def get_single_post_request(self, unique_id: str):
+        etag = f'"{self.cache.data_version()}"'
+        post = self.cache.get_post_by_id(unique_id)
+
+        if post is None:
+            return 404, "Not Found"
+        elif self.not_modified(etag):
+            return 304, "Not Modified", None, {"ETag": etag}
+        else:
+            return 200, "OK", post, {"ETag": etag}
+
+    def get_statistics_request(self):
+        return 200, "OK", self.cache.statistics()
+
+    def get_metrics_request(self):
+        self.cache.update_metrics()
+        if self.metrics is not registry:
+            # Requests this worker served since its last periodic merge are not left out of the answer
+            self.metrics.merge(str(os.getpid()), registry.snapshot())
+        return 200, "OK", self.metrics.render().encode("utf-8"), {"Content-Type": METRICS_CONTENT_TYPE}
+
+    def post_request(self, post_data: dict):
+        if not is_valid_post(post_data):
+            return 400, "Bad Request"
+
+        unique_id = post_data["unique_id"]
+        if self.cache.append(unique_id, post_data):
+            line_number = self.cache.cache_size()
+            return 201, "Created", {unique_id: line_number}
+        else:
+            return 200, "OK"
+
+    def batch_post_request(self, posts: list):
+        if not isinstance(posts, list):
+            return 400, "Bad Request"
+
+        created = iter(self.cache.append_many([(post["unique_id"], post) for post in posts if is_valid_post(post)]))
+        results = [
+            {"unique_id": post["unique_id"], "status": "created" if next(created) else "exists"}
+            if is_valid_post(post) else {"unique_id": None, "status": "invalid"}
+            for post in posts
+        ]
+
+        return 200, "OK", results
+
+    def delete_request(self, unique_id: str) -> Tuple[int, str]:
+        if self.cache.delete(unique_id):
+            return 200, "OK"
+        else:
+            return 205, "No Content"
+
+    def put_request(self, post_data: dict, unique_id: str) -> Tuple[int, str]:
+        if not is_valid_post(post_data, unique_id_required=False) or not is_field_value(unique_id):
+            return 400, "Bad Request"
+
+        if self.cache.modify(unique_id, post_data):
+            return 200, "OK"
+        else:
+            return 205, "No Content"
+
+
+def json_array_chunks(pages: Iterable[list]) -> Iterator[bytes]:
+    """Serialize pages of items as one JSON array, a page at a time"""
+    separator = b"["
+    for page in pages:
+        if page:
+            yield separator + ", ".join(json.dumps(item, default=json_default) for item in page).encode("utf-8")
+            separator = b", "
+
+    yield b"]" if separator == b", " else b"[]"
+
+
+def is_valid_post(post, unique_id_required: bool = True) -> bool:
+    """Checked before the cache is touched, so a post the cache would reject never gets halfway into it"""
+    if not isinstance(post, dict) or not has_valid_fields(post):
+        return False
+
+    return not unique_id_required or (type(post.get("unique_id")) is str and post["unique_id"] != "")
+
+
+def parse_request_body(headers, raw_body: bytes) -> dict or list:
+    body = raw_body.decode("utf-8")
+    if headers.get('Content-Type', '').startswith('application/x-ndjson'):
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+    return json.loads(body)
+
+
+def encode_json_body(body) -> bytes:
+    if isinstance(body, bytes):
+        return body
+
+    return json.dumps(body, default=json_default).encode("utf-8") if body else b""
+
+
+def body_allowed(status_code: int) -> bool:
+    return status_code not in (204, 304)
@@ -1,51 +1,101 @@
+import logging
+import mmap
 import os
+import shutil
+from contextlib import nullcontext
 from datetime import datetime
+from typing import Iterator
+
+from post_record import PostRecord, POST_FIELDS
+
+LOG_APPEND = "A"
+LOG_MODIFY = "M"
+LOG_DELETE = "D"
+# Deleted or relocated records are overwritten in place, their first byte marks them as dead
+TOMBSTONE = "#"
+
+# filename -> (data file signature, {unique_id: (offset, length)})
+_post_indexes = {}
 
 
 def get_single_post(filename: str, unique_id: str) -> str or None:
-    if post_exist_in_file(filename, unique_id):
-        with open(filename, "r") as file:
-            for post in file:
-                if unique_id in post:
-                    return post
+    location = get_post_index(filename).get(unique_id)
+    if location is None:
+        return None
 
-    return None
+    with open(filename, "rb") as file:
+        return read_record(file, *location)
 
 
 def get_all_posts(filename: str) -> list:
-    return [deserialize_post_data(post) for post in read_all_posts(filename)]
+    return list(iterate_posts(filename))
 
 
-def save_all_posts(filename: str, all_posts: dict):
-    with open(filename, "w") as file:
-        file.writelines(
-            [f"{serialize_post_data(unique_id, post)}{os.linesep}" for unique_id, post in all_posts.items()]
-        )
+def iterate_posts(filename: str) -> Iterator[dict]:
+    """Yield deserialized posts one at a time straight from a memory map of the file"""
+    if not file_exist(filename):
+        create_file(filename)
 
+    if os.path.getsize(filename) == 0:
+        return
 
-def delete_post(filename: str, unique_id: str) -> bool:
-    if post_exist_in_file(filename, unique_id):
-        all_posts = read_all_posts(filename)
-        with open(filename, "w") as file:
-            file.writelines([post for post in all_posts if unique_id not in post])
+    tombstone = TOMBSTONE.encode("utf-8")
+    with open(filename, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+        for record in iter(mapped_file.readline, b""):
+            if record.strip() and not record.startswith(tombstone):
+                yield deserialize_post_data(record.decode("utf-8"))
 
-        return True
 
-    return False
+def save_all_posts(filename: str, all_posts: dict, replace_lock=None):
+    temporary_filename = f"{filename}.tmp"
+    index, offset = {}, 0
+    with open(temporary_filename, "wb") as file:
+        for unique_id, post in all_posts.items():
+            record = encode_record(serialize_post_data(unique_id, post))
+            file.write(record)
+            index[unique_id] = (offset, len(record))
+            offset += len(record)
 
+    with replace_lock or nullcontext():
+        os.replace(temporary_filename, filename)
+        save_post_index(filename, index)
 
-def modify_post(filename: str, unique_id: str, post_data: dict) -> bool:
-    if post_exist_in_file(filename, unique_id):
-        all_posts = read_all_posts(filename)
-        with open(filename, "w") as file:
-            file.writelines(
-                [f"{serialize_post_data(unique_id, post_data)}{os.linesep}" if unique_id in post else post
-                 for post in all_posts]
-            )
 
-        return True
+def delete_post(filename: str, unique_id: str) -> bool:
+    index = get_post_index(filename)
+    location = index.pop(unique_id, None)
+    if location is None:
+        return False
 
-    return False
+    with open(filename, "r+b") as file:
+        write_tombstone(file, location[0])
+
+    append_index_record(filename, unique_id, -1, 0)
+    return True
+
+
+def modify_post(filename: str, unique_id: str, post_data: dict) -> bool:
+    index = get_post_index(filename)
+    location = index.get(unique_id)
+    if location is None:
+        return False
+
+    offset, length = location
+    serialized_post = serialize_post_data(unique_id, post_data)
+    record = encode_record(serialized_post)
+    with open(filename, "r+b") as file:
+        if len(record) <= length:
+            # Shorter record is padded with spaces so that the following records stay where they are
+            file.seek(offset)
+            file.write(encode_record(serialized_post, length))
+        else:
+            write_tombstone(file, offset)
+            offset, length = file.seek(0, os.SEEK_END), len(record)
+            file.write(record)
+
+    index[unique_id] = (offset, length)
+    append_index_record(filename, unique_id, offset, length)
+    return True
 
 
 def generate_filename() -> str:
@@ -53,6 +103,50 @@ def generate_filename() -> str:
     return f"reddit-{current_date.strftime('%Y%m%d')}.txt"
 
 
+def generate_log_filename(filename: str) -> str:
+    return f"{os.path.splitext(filename)[0]}.log"
+
+
+def rotate_log(log_filename: str) -> str:
+    """Move the active log aside so that a snapshot can be written while new records go to a fresh log.
+
+    A log left aside by a compaction that never wrote its snapshot is not covered by any snapshot yet, the active
+    log is added to its end instead of replacing it.
+    """
+    rotated_log_filename = f"{log_filename}.compacting"
+    if not file_exist(log_filename):
+        return rotated_log_filename
+
+    if not file_exist(rotated_log_filename):
+        os.replace(log_filename, rotated_log_filename)
+        return rotated_log_filename
+
+    truncate_torn_record(rotated_log_filename)
+    with open(log_filename, "rb") as log_file, open(rotated_log_filename, "ab") as rotated_log_file:
+        shutil.copyfileobj(log_file, rotated_log_file)
+    # Interrupted before this, the copied records are replayed twice in the same order, which ends in the same state
+    os.remove(log_filename)
+    return rotated_log_filename
+
+
+def truncate_torn_record(filename: str) -> None:
+    """Cut the file back to its last line ending, a record a crash left without one would get the next record
+    written onto its end"""
+    if not file_exist(filename) or os.path.getsize(filename) == 0:
+        return
+
+    with open(filename, "r+b") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            end = mapped_file.rfind(os.linesep.encode("utf-8")) + len(os.linesep)
+        if end < os.fstat(file.fileno()).st_size:
+            file.truncate(max(end, 0))
+
+
+def remove_file(filename: str) -> None:
+    if file_exist(filename):
+        os.remove(filename)
+
+
 def file_exist(filename: str) -> bool:
     if os.path.isfile(filename):
         return True
@@ -66,8 +160,7 @@ def create_file(filename: str) -> None:
 
 
 def get_line_number(filename: str) -> int:
-    with open(filename, "r") as file:
-        return len(file.readlines())
+    return len(get_post_index(filename))
 
 
 def read_all_posts(filename: str) -> list:
@@ -75,27 +168,116 @@ def read_all_posts(filename: str) -> list:
         create_file(filename)
 
     with open(filename, "r") as file:
-        return file.readlines()
+        return [post for post in file if post.strip() and not post.startswith(TOMBSTONE)]
 
 
 def save_post_to_file(filename: str, parsed_post_data: str) -> None:
-    with open(filename, "a") as file:
-        file.write(f"{parsed_post_data}{os.linesep}")
+    index = get_post_index(filename)
+    record = encode_record(parsed_post_data)
+    with open(filename, "ab") as file:
+        offset = file.seek(0, os.SEEK_END)
+        file.write(record)
+
+    unique_id = parsed_post_data.split(";", 1)[0]
+    index[unique_id] = (offset, len(record))
+    append_index_record(filename, unique_id, offset, len(record))
 
 
 def post_exist_in_file(filename: str, unique_id: str) -> bool:
+    return unique_id in get_post_index(filename)
+
+
+def generate_index_filename(filename: str) -> str:
+    return f"{os.path.splitext(filename)[0]}.idx"
+
+
+def encode_record(serialized_post: str, length: int = 0) -> bytes:
+    record = serialized_post.encode("utf-8")
+    line_ending = os.linesep.encode("utf-8")
+    return record + b" " * (length - len(record) - len(line_ending)) + line_ending
+
+
+def read_record(file, offset: int, length: int) -> str:
+    file.seek(offset)
+    return file.read(length).decode("utf-8")
+
+
+def write_tombstone(file, offset: int) -> None:
+    file.seek(offset)
+    file.write(TOMBSTONE.encode("utf-8"))
+
+
+def file_signature(filename: str) -> tuple:
+    file_stat = os.stat(filename)
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+
+def get_post_index(filename: str) -> dict:
+    """Return the unique_id -> (offset, length) index, reloading it only when the data file changed behind our back"""
     if not file_exist(filename):
         create_file(filename)
 
-    with open(filename, "r") as file:
-        return unique_id in file.read()
+    signature = file_signature(filename)
+    cached_signature, index = _post_indexes.get(filename, (None, None))
+    if cached_signature != signature:
+        index = load_post_index(filename)
+        _post_indexes[filename] = (signature, index)
+
+    return index
+
+
+def load_post_index(filename: str) -> dict:
+    index_filename = generate_index_filename(filename)
+    # Every write to the data file is followed by an index record, an older index is stale
+    if not file_exist(index_filename) or os.stat(index_filename).st_mtime_ns < os.stat(filename).st_mtime_ns:
+        return build_post_index(filename)
+
+    index = {}
+    with open(index_filename, "r") as file:
+        for record in file:
+            if not record.endswith(os.linesep):
+                continue
+
+            unique_id, offset, length = record.rstrip(os.linesep).split(";")
+            if int(offset) < 0:
+                index.pop(unique_id, None)
+            else:
+                index[unique_id] = (int(offset), int(length))
+
+    return index
+
+
+def build_post_index(filename: str) -> dict:
+    index, offset = {}, 0
+    with open(filename, "rb") as file:
+        for record in file:
+            if record.strip() and not record.startswith(TOMBSTONE.encode("utf-8")):
+                index[record.split(b";", 1)[0].decode("utf-8")] = (offset, len(record))
+            offset += len(record)
+
+    save_post_index(filename, index)
+    return index
+
+
+def save_post_index(filename: str, index: dict) -> None:
+    index_filename = generate_index_filename(filename)
+    temporary_filename = f"{index_filename}.tmp"
+    with open(temporary_filename, "w") as file:
+        file.writelines([f"{unique_id};{offset};{length}{os.linesep}" for unique_id, (offset, length) in index.items()])
+
+    os.replace(temporary_filename, index_filename)
+    _post_indexes[filename] = (file_signature(filename), index)
+
+
+def append_index_record(filename: str, unique_id: str, offset: int, length: int) -> None:
+    with open(generate_index_filename(filename), "a") as file:
+        file.write(f"{unique_id};{offset};{length}{os.linesep}")
+
+    _post_indexes[filename] = (file_signature(filename), _post_indexes[filename][1])
 
 
 def get_post_information_sequence() -> list:
-    return [
-        "post_url", "username", "user_karma", "user_cake_day", "post_karma", "comment_karma",
-        "post_date", "comments_number", "votes_number", "post_category"
-    ]
+    return list(POST_FIELDS[1:])
 
 
 def serialize_post_data(unique_id: str, parsed_data: dict):
@@ -107,11 +289,54 @@ def serialize_post_data(unique_id: str, parsed_data: dict):
     return output_string
 
 
-def deserialize_post_data(post: str) -> dict:
-    sequence = get_post_information_sequence()
-    sequence.insert(0, "unique_id")
+def deserialize_post_data(post: str) -> PostRecord:
+    # Records modified in place are padded with spaces up to their original length
+    return PostRecord.from_values(post.rstrip().split(";"))
+
+
+def serialize_log_record(operation: str, unique_id: str, post_data: dict = None) -> str:
+    if operation == LOG_DELETE:
+        return ";".join([operation, unique_id])
+
+    return ";".join([operation, serialize_post_data(unique_id, post_data)])
+
+
+def deserialize_log_record(record: str) -> tuple:
+    """Raises ValueError for a line that is not a whole log record"""
+    operation, serialized_post = record.rstrip(os.linesep).split(";", 1)
+    if operation == LOG_DELETE and ";" not in serialized_post:
+        return operation, serialized_post, None
+
+    values = serialized_post.split(";")
+    if operation not in (LOG_APPEND, LOG_MODIFY) or len(values) != len(POST_FIELDS):
+        raise ValueError(f"Malformed log record: {record!r}")
+
+    post = PostRecord.from_values(values)
+    return operation, post["unique_id"], post
+
+
+def append_log_records(log_file, records: list) -> None:
+    log_file.writelines(
+        [f"{serialize_log_record(operation, unique_id, post_data)}{os.linesep}"
+         for operation, unique_id, post_data in records]
+    )
+
+
+def read_log_records(log_filename: str) -> list:
+    if not file_exist(log_filename):
+        return []
+
+    log_records = []
+    with open(log_filename, "r") as file:
+        for line_number, record in enumerate(file, 1):
+            # A record without a line ending was torn by a crash in the middle of a write
+            if not record.endswith(os.linesep):
+                continue
 
-    post_information = post.rstrip(os.linesep).split(";")
-    post = {key: value for key, value in zip(sequence, post_information)}
+            try:
+                log_records.append(deserialize_log_record(record))
+            except ValueError as exception:
+                # One broken record must not keep the server from starting with all the others
+                logging.error(f"Skip line {line_number} of {log_filename}: {exception}")
 
-    return post
+    return log_records
@@ -0,0 +1,145 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict
+
+from cssselect import GenericTranslator, parse
+from cssselect.parser import CombinedSelector
+from lxml import etree, html
+
+from cake_day import parse_cake_day
+
+# How the element on the left of a combinator is reached from the one on its right, as the start of an XPath step
+COMBINATOR_AXES = {
+    " ": "ancestor::", ">": "parent::", "~": "preceding-sibling::", "+": "preceding-sibling::*[1]/self::"
+}
+
+
+def compile_selector(css: str, document: bool = False) -> etree.XPath:
+    """CSS selector as an XPath matching the way select_one does: the elements found are under the one the selector
+    is applied to, while the ones the combinators lead to may be anywhere above it.
+
+    Applied to a whole document when `document` is set, the root element can be matched as well.
+    """
+    translator = GenericTranslator()
+    expressions = []
+    for selector in parse(css):
+        tree = selector.parsed_tree
+        steps = []
+        while isinstance(tree, CombinedSelector):
+            steps.append((tree.combinator, tree.subselector))
+            tree = tree.selector
+
+        expression = str(translator.xpath(tree))
+        for combinator, compound in reversed(steps):
+            expression = f"{translator.xpath(compound)}[{COMBINATOR_AXES[combinator]}{expression}]"
+        expressions.append(f"{'/' if document else ''}descendant::{expression}")
+
+    return etree.XPath(" | ".join(expressions))
+
+
+POSTS = compile_selector("div.Post")
+COMMENT_SPANS = compile_selector("a > span")
+FIRST_DIV = compile_selector("div")
+
+
+class CompiledSelectors:
+    """Templates of xpath_config.json compiled once instead of on every select_one"""
+
+    def __init__(self, xpath_templates: Dict[str, str]):
+        self._selectors = {name: compile_selector(css) for name, css in xpath_templates.items()}
+        self._document_selectors = {name: compile_selector(css, document=True)
+                                    for name, css in xpath_templates.items()}
+
+    def select(self, name: str, element) -> list:
+        if isinstance(element, etree._ElementTree):
+            return self._document_selectors[name](element)
+
+        return self._selectors[name](element)
+
+    def select_one(self, name: str, element):
+        """First match, None when there is none or no element to look in"""
+        if element is None:
+            return None
+
+        matches = self.select(name, element)
+        return matches[0] if matches else None
+
+
+def child_elements(element) -> list:
+    # Comments and processing instructions are children in lxml, they are not tags
+    return [child for child in element if isinstance(child.tag, str)]
+
+
+def get_posts_list(page_html: str, selectors: CompiledSelectors) -> list:
+    document = html.document_fromstring(page_html).getroottree()
+    return POSTS(selectors.select_one("all_posts_block", document))
+
+
+def parse_publication_date(tag_with_date) -> str:
+    days_ago = int(tag_with_date.text_content().split(" ")[0])
+    post_date = datetime.today() - timedelta(days=days_ago)
+    return str(post_date.date())
+
+
+def parse_comment_number(post, selectors: CompiledSelectors) -> str:
+    comments_number = child_elements(selectors.select_one("comments_number_inside_post", post))[-1]
+    comments_number = COMMENT_SPANS(comments_number)
+
+    # Representation may have distinct html formats
+    if len(comments_number) == 1:
+        return comments_number[0].text_content().split(" ")[0]
+    else:
+        return child_elements(FIRST_DIV(comments_number[0])[0])[-1].text_content()
+
+
+def parse_main_page(current_post_info, post, post_id, logger: logging.Logger, selectors: CompiledSelectors):
+    current_post_info["votes_number"] = selectors.select_one("votes_number_inside_post", post).text_content()
+
+    top_post_html_source = child_elements(selectors.select_one("top_post_line_block", post))[0]
+    if top_post_html_source.tag == "article":
+        top_post_html_source = selectors.select_one("article_shell", top_post_html_source)
+    else:
+        top_post_html_source = selectors.select_one("div_shell", top_post_html_source)
+
+    all_a_tags_inside_block = list(top_post_html_source.iterdescendants("a"))
+    current_post_info["post_url"] = all_a_tags_inside_block[-1].get("href")
+    current_post_info["post_category"] = selectors.select_one("post_category", top_post_html_source)\
+        .text_content().lstrip("r/")
+
+    # User deleted
+    if len(all_a_tags_inside_block) == 2:
+        logger.debug(f"The post (post_id: {post_id}, url: {current_post_info['post_url']}) "
+                     f"exists, but the user has been deleted!")
+        return None
+
+    name_parse_string = all_a_tags_inside_block[1]
+    current_post_info["username"] = name_parse_string.text_content().lstrip("u/")
+    current_post_info["post_date"] = parse_publication_date(all_a_tags_inside_block[-1])
+    current_post_info["comments_number"] = parse_comment_number(post, selectors)
+    user_page_url = "".join(["https://www.reddit.com", name_parse_string.get("href")])
+
+    return user_page_url
+
+
+def get_profile_block(user_page_html: str or None, selectors: CompiledSelectors):
+    if user_page_html is None:
+        return None
+
+    return selectors.select_one("user_profile_block", html.document_fromstring(user_page_html).getroottree())
+
+
+def parse_user_page(user_profile_info, user_page_url, current_post_info, logger: logging.Logger,
+                    selectors: CompiledSelectors) -> bool:
+    try:
+        current_post_info["user_karma"] = selectors.select_one("user_karma", user_profile_info).text_content()
+        current_post_info["user_cake_day"] = parse_cake_day(
+            selectors.select_one("user_cake_day", user_profile_info).text_content()
+        )
+    except AttributeError:
+        logger.debug(f"Failed to access user(username: {current_post_info['username']}, "
+                     f"link: {user_page_url}) page due to age limit!")
+        return False
+
+    # Cake day that reads as no date at all fails the page like a missing one
+    return current_post_info["user_cake_day"] is not None
+
@@ -0,0 +1,131 @@
+import bisect
+import threading
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+
+class Metrics:
+    """Counters, gauges and histograms kept in plain dicts under one lock, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        # (name, labels) -> [bucket counts, sum, count], the buckets are not cumulative until rendered
+        self._histograms = {}
+        self._histogram_buckets = {}
+        self._help = {}
+        # source -> latest snapshot of another process, in the order they were last merged
+        self._sources = {}
+
+    def describe(self, name: str, description: str, buckets: tuple = None) -> None:
+        self._help[name] = description
+        if buckets is not None:
+            self._histogram_buckets[name] = buckets
+
+    def increment(self, name: str, labels: tuple = (), value: float = 1) -> None:
+        with self._lock:
+            self._counters[name, labels] = self._counters.get((name, labels), 0) + value
+
+    def set_counter(self, name: str, value: float, labels: tuple = ()) -> None:
+        """Take over a counter kept elsewhere"""
+        with self._lock:
+            self._counters[name, labels] = value
+
+    def set_gauge(self, name: str, value: float, labels: tuple = ()) -> None:
+        with self._lock:
+            self._gauges[name, labels] = value
+
+    def observe(self, name: str, value: float, labels: tuple = ()) -> None:
+        buckets = self._histogram_buckets.get(name, LATENCY_BUCKETS)
+        bucket_number = bisect.bisect_left(buckets, value)
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[name, labels] = [[0] * (len(buckets) + 1), 0, 0]
+            histogram[0][bucket_number] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def snapshot(self) -> tuple:
+        """Counters, gauges and histograms of this registry as plain dicts, to be merged into another one"""
+        with self._lock:
+            return dict(self._counters), dict(self._gauges), \
+                {key: [list(value[0]), value[1], value[2]] for key, value in self._histograms.items()}
+
+    def merge(self, source: str, snapshot: tuple) -> None:
+        """Render the metrics of another process along with these, a newer snapshot of a source replaces its last one"""
+        with self._lock:
+            self._sources.pop(source, None)
+            self._sources[source] = snapshot
+
+    def render(self) -> str:
+        counters, gauges, histograms = self.snapshot()
+        with self._lock:
+            sources = list(self._sources.values())
+
+        # Counters and histograms add up, a gauge keeps the value of the last merged source, own values win over all
+        merged_gauges = {}
+        for source_counters, source_gauges, source_histograms in sources:
+            for key, value in source_counters.items():
+                counters[key] = counters.get(key, 0) + value
+            merged_gauges.update(source_gauges)
+            for key, (bucket_counts, total, count) in source_histograms.items():
+                histogram = histograms.setdefault(key, [[0] * len(bucket_counts), 0, 0])
+                histogram[0] = [left + right for left, right in zip(histogram[0], bucket_counts)]
+                histogram[1] += total
+                histogram[2] += count
+        gauges = {**merged_gauges, **gauges}
+
+        lines = []
+        for metric_type, values in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({name for name, _ in values}):
+                lines.extend(self._header(name, metric_type))
+                lines.extend(f"{name}{format_labels(labels)} {value}"
+                             for (metric_name, labels), value in sorted(values.items()) if metric_name == name)
+
+        for name in sorted({name for name, _ in histograms}):
+            lines.extend(self._header(name, "histogram"))
+            buckets = self._histogram_buckets.get(name, LATENCY_BUCKETS)
+            for (metric_name, labels), (bucket_counts, total, count) in sorted(histograms.items()):
+                if metric_name != name:
+                    continue
+
+                cumulative_count = 0
+                for bound, bucket_count in zip(buckets + ("+Inf",), bucket_counts):
+                    cumulative_count += bucket_count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative_count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def _header(self, name: str, metric_type: str) -> list:
+        header = [f"# TYPE {name} {metric_type}"]
+        if name in self._help:
+            header.insert(0, f"# HELP {name} {self._help[name]}")
+
+        return header
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+registry = Metrics()
+registry.describe("http_requests_total", "Requests served by route, method and status")
+registry.describe("http_request_duration_seconds", "Time from dispatch to the last byte of the response")
+registry.describe("http_request_size_bytes", "Request body size", SIZE_BUCKETS)
+registry.describe("http_response_size_bytes", "Response body size", SIZE_BUCKETS)
+registry.describe("cache_backup_duration_seconds", "Time to write a cache snapshot")
+registry.describe("cache_backup_size_bytes", "Size of the last cache snapshot")
+registry.describe("cache_posts", "Posts currently in the cache")
+registry.describe("cache_posts_in_memory", "Posts of a bounded cache held in memory")
+registry.describe("cache_bytes_in_memory", "Estimated size of the posts of a bounded cache held in memory")
+registry.describe("cache_hits_total", "Reads of a bounded cache served from memory")
+registry.describe("cache_misses_total", "Reads of a bounded cache served from the snapshot")
+registry.describe("cache_evictions_total", "Posts of a bounded cache dropped from memory")
@@ -0,0 +1,122 @@
+import argparse
+import itertools
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from typing import Dict, List
+
+from logging_converter import string_to_logging_level
+from lxml_extraction import CompiledSelectors, get_posts_list, get_profile_block, parse_main_page, parse_user_page
+from parser import (
+    config_logger, generate_filename, load_xpath_templates_from_json, parse_popup_html, serialize_output_string,
+    write_to_file
+)
+from profile_cache import username_from_url
+
+# Selectors of the templates, compiled once by every process of the pool
+_selectors = None
+# Profiles parsed by this process, users with several posts are read once, None for unreadable ones
+_profiles = {}
+
+
+def compile_selectors(xpath_templates: Dict[str, str]) -> None:
+    global _selectors
+    _selectors = CompiledSelectors(xpath_templates)
+
+
+def find_feed_snapshots(directory: str) -> List[str]:
+    """Saved feed pages of a snapshot directory, profiles are in user/<username>.html, hover popups of the posts
+    in popup/<post id>.html"""
+    return sorted(glob(os.path.join(directory, "feed*.html")))
+
+
+def read_snapshot(filename: str) -> str or None:
+    if not os.path.isfile(filename):
+        return None
+
+    with open(filename) as file:
+        return file.read()
+
+
+def parse_saved_profile(directory: str, user_page_url: str, logger: logging.Logger) -> Dict[str, str] or None:
+    username = username_from_url(user_page_url)
+    profile_filename = os.path.join(directory, "user", f"{username}.html")
+    if profile_filename not in _profiles:
+        user_profile_info = get_profile_block(read_snapshot(profile_filename), _selectors)
+        user_info = {"username": username}
+        if parse_user_page(user_profile_info, user_page_url, user_info, logger, _selectors):
+            _profiles[profile_filename] = {"user_karma": user_info["user_karma"],
+                                           "user_cake_day": user_info["user_cake_day"]}
+        else:
+            _profiles[profile_filename] = None
+
+    return _profiles[profile_filename]
+
+
+def extract_feed_snapshot(feed_filename: str) -> List[str]:
+    """Serialized posts of a saved feed page, a post is skipped for the same reasons as in a live crawl"""
+    directory = os.path.dirname(feed_filename)
+    logger = logging.getLogger("reddit_parser")
+    serialized_posts = []
+
+    for post in get_posts_list(read_snapshot(feed_filename), _selectors):
+        current_post_info = {}
+        post_id = post.get("id")
+        user_page_url = parse_main_page(current_post_info, post, post_id, logger, _selectors)
+        if user_page_url is None:
+            continue
+
+        popup_html = read_snapshot(os.path.join(directory, "popup", f"{post_id}.html"))
+        if popup_html is None:
+            logger.debug(f"Popup menu was not saved for this post(url: {current_post_info['post_url']}).")
+            continue
+        parse_popup_html(current_post_info, popup_html)
+
+        user_info = parse_saved_profile(directory, user_page_url, logger)
+        if user_info is None:
+            continue
+        current_post_info.update(user_info)
+        serialized_posts.append(serialize_output_string(current_post_info))
+
+    return serialized_posts
+
+
+def extract_snapshots(directory: str, output_filename: str, workers: int = None) -> int:
+    """Extract every saved feed page of the directory into the posts file, one feed page per task of the pool,
+    returns the number of posts written"""
+    feed_filenames = find_feed_snapshots(directory)
+    xpath_templates = load_xpath_templates_from_json()
+
+    with ProcessPoolExecutor(workers, initializer=compile_selectors, initargs=(xpath_templates,)) as executor:
+        serialized_posts = executor.map(extract_feed_snapshot, feed_filenames)
+        serialized_posts = list(itertools.chain.from_iterable(serialized_posts))
+
+    write_to_file(output_filename, serialized_posts)
+    return len(serialized_posts)
+
+
+def parse_command_line_arguments() -> argparse.Namespace:
+    argument_parser = argparse.ArgumentParser(description="Reddit parser over saved pages")
+    argument_parser.add_argument("directory", type=str, help="Directory of saved feed, profile and popup pages")
+    argument_parser.add_argument("--output", metavar="output", type=str, default=None,
+                                 help="Posts file, named after the current time by default")
+    argument_parser.add_argument("--workers", metavar="workers", type=int, default=os.cpu_count(),
+                                 help="Processes extracting feed pages in parallel")
+    argument_parser.add_argument("--log_level", metavar="log_level", type=str, default="INFO",
+                                 choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                                 help="Minimal logging level('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')")
+
+    return argument_parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_command_line_arguments()
+    configured_logger = config_logger(string_to_logging_level(arguments.log_level))
+    output = arguments.output or generate_filename()
+
+    start = time.time()
+    written_posts = extract_snapshots(arguments.directory, output, arguments.workers)
+    configured_logger.info(f"{written_posts} posts of {arguments.directory} were placed in {output} "
+                           f"in {time.time() - start:.2f} seconds!")
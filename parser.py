@@ -6,9 +6,8 @@ import json
 import aiohttp
 import logging
 import argparse
-import dateparser
 from typing import List, Dict, Tuple
-from datetime import datetime, timedelta
+from datetime import datetime
 from bs4 import BeautifulSoup
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -18,6 +17,9 @@ from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
 
 from logging_converter import string_to_logging_level
+from lxml_extraction import CompiledSelectors, get_profile_block, parse_main_page, parse_user_page
+from post_feed import PostFeed
+from profile_cache import ProfileCache, username_from_url
 
 
 def write_to_file(filename: str, data: List[str]) -> None:
@@ -65,13 +67,6 @@ def truncate_file_content(filename: str) -> None:
             file.truncate()
 
 
-def get_posts_list(html, xpath_templates):
-    soup = BeautifulSoup(html, "lxml")
-    all_posts_html = soup.select_one(xpath_templates["all_posts_block"])
-
-    return all_posts_html.find_all("div", class_="Post")
-
-
 def config_logger(log_level: int) -> logging.Logger:
     logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
     logger = logging.getLogger("reddit_parser")
@@ -79,86 +74,21 @@ def config_logger(log_level: int) -> logging.Logger:
     return logger
 
 
-def get_user_html_from_new_browser_tab(browser, user_page_url, xpath_templates):
+def get_user_html_from_new_browser_tab(browser, user_page_url, selectors: CompiledSelectors):
     browser.execute_script(f"window.open('{user_page_url}');")
     browser.switch_to.window(browser.window_handles[1])
-    user_page_html = browser.page_source
-    soup = BeautifulSoup(user_page_html, "lxml")
-    user_profile_info = soup.select_one(xpath_templates["user_profile_block"])
+    user_profile_info = get_profile_block(browser.page_source, selectors)
 
     browser.close()
     browser.switch_to.window(browser.window_handles[0])
     return user_profile_info
 
 
-def parse_publication_date(tag_with_date):
-    publish_date = tag_with_date.get_text()
-    days_ago = int(publish_date.split(" ")[0])
-    post_date = datetime.today() - timedelta(days=days_ago)
-    return str(post_date.date())
-
-
-def parse_comment_number(post, xpath_templates):
-    comments_number = post.select_one(xpath_templates["comments_number_inside_post"]).find_all(recursive=False)[-1]
-    comments_number = comments_number.select("a > span")
-
-    # Representation may have distinct html formats
-    if len(comments_number) == 1:
-        return comments_number[0].get_text().split(" ")[0]
-    else:
-        return comments_number[0].select_one("div").find_all(recursive=False)[-1].get_text()
-
-
 def hover_current_post_element(browser, element):
     hover = webdriver.ActionChains(browser).move_to_element(element)
     hover.perform()
 
 
-def parse_main_page(current_post_info, post, post_id, logger, xpath_templates):
-    current_post_info["votes_number"] = post.select_one(xpath_templates["votes_number_inside_post"]).get_text()
-
-    top_post_html_source = post.select_one(xpath_templates["top_post_line_block"]).findChildren(recursive=False)[0]
-    if top_post_html_source.name == "article":
-        top_post_html_source = top_post_html_source.select_one(xpath_templates["article_shell"])
-    else:
-        top_post_html_source = top_post_html_source.select_one(xpath_templates["div_shell"])
-
-    all_a_tags_inside_block = top_post_html_source.find_all("a")
-    current_post_info["post_url"] = all_a_tags_inside_block[-1]["href"]
-    current_post_info["post_category"] = top_post_html_source.select_one(xpath_templates["post_category"])\
-        .get_text().lstrip("r/")
-
-    # User deleted
-    if len(all_a_tags_inside_block) == 2:
-        logger.debug(f"The post (post_id: {post_id}, url: {current_post_info['post_url']}) "
-                     f"exists, but the user has been deleted!")
-        return None
-
-    name_parse_string = all_a_tags_inside_block[1]
-    current_post_info["username"] = name_parse_string.get_text().lstrip("u/")
-    current_post_info["post_date"] = parse_publication_date(all_a_tags_inside_block[-1])
-    current_post_info["comments_number"] = parse_comment_number(post, xpath_templates)
-    user_page_url = "".join(["https://www.reddit.com", name_parse_string["href"]])
-
-    return user_page_url
-
-
-def parse_user_page(user_profile_info, user_page_url, current_post_info, logger, xpath_templates):
-    try:
-        current_post_info["user_karma"] = user_profile_info.select_one(xpath_templates["user_karma"]).get_text()
-        user_cake_day = dateparser.parse(user_profile_info
-                                         .select_one(xpath_templates["user_cake_day"])
-                                         .get_text())
-
-        current_post_info["user_cake_day"] = str(user_cake_day.date())
-    except AttributeError:
-        logger.debug(f"Failed to access user(username: {current_post_info['username']}, "
-                     f"link: {user_page_url}) page due to age limit!")
-        return False
-
-    return True
-
-
 def navigate_popup_menu(browser, post_id, current_post_info, logger):
     popup_menu = browser.find_element_by_id(f"UserInfoTooltip--{post_id}")
     popup_menu = popup_menu.find_element_by_xpath("..")
@@ -177,7 +107,11 @@ def navigate_popup_menu(browser, post_id, current_post_info, logger):
 
 
 def parse_popup_menu(current_post_info, popup_element):
-    popup_menu_info = BeautifulSoup(popup_element.get_attribute("innerHTML"), "html.parser")\
+    parse_popup_html(current_post_info, popup_element.get_attribute("innerHTML"))
+
+
+def parse_popup_html(current_post_info, popup_html):
+    popup_menu_info = BeautifulSoup(popup_html, "html.parser")\
         .findChildren(recursive=False)[-2]\
         .findChildren(recursive=False)[-3]
 
@@ -187,27 +121,30 @@ def parse_popup_menu(current_post_info, popup_element):
 
 
 def parse_reddit_page(chrome_drive_path: str, post_count: int, logger: logging.Logger,
-                      xpath_templates: Dict[str, str]) -> None:
+                      xpath_templates: Dict[str, str], batch_sending: bool = False,
+                      profile_cache: ProfileCache = None) -> None:
     filename = generate_filename()
     truncate_file_content(filename)
     logger.info(f"The filename: {filename}!")
     browser = config_browser(chrome_drive_path)
+    selectors = CompiledSelectors(xpath_templates)
+    profile_cache = profile_cache or ProfileCache()
     parsed_information = []
 
     try:
         browser.get("https://www.reddit.com/top/?t=month")
+        feed = PostFeed(browser, xpath_templates)
         total_posts_count, parsed_post_count = 0, 0
 
         while parsed_post_count < post_count:
             current_post_info = {}
-            single_posts = get_posts_list(browser.page_source, xpath_templates)
-            post = single_posts[total_posts_count]
-            post_id = post["id"]
+            post = feed[total_posts_count]
+            post_id = post.get("id")
 
             current_post = browser.find_element_by_id(post_id)
             hover_current_post_element(browser, current_post)
 
-            user_page_url = parse_main_page(current_post_info, post, post_id, logger, xpath_templates)
+            user_page_url = parse_main_page(current_post_info, post, post_id, logger, selectors)
             if user_page_url is None:
                 total_posts_count += 1
                 continue
@@ -218,14 +155,20 @@ def parse_reddit_page(chrome_drive_path: str, post_count: int, logger: logging.L
                 continue
 
             total_posts_count += 1
-            user_profile_info = get_user_html_from_new_browser_tab(browser, user_page_url, xpath_templates)
-            if parse_user_page(user_profile_info, user_page_url, current_post_info, logger, xpath_templates):
-                current_post_info["unique_id"] = generate_uuid()
-                parsed_information.append(current_post_info)
-                logger.debug(f"All information has been received on this post(url: {current_post_info['post_url']})")
-                parsed_post_count += 1
+            username = username_from_url(user_page_url)
+            user_profile = profile_cache.get(username)
+            if user_profile is not None:
+                current_post_info.update(user_profile)
             else:
-                continue
+                user_profile_info = get_user_html_from_new_browser_tab(browser, user_page_url, selectors)
+                if not parse_user_page(user_profile_info, user_page_url, current_post_info, logger, selectors):
+                    continue
+                profile_cache.put(username, current_post_info)
+
+            current_post_info["unique_id"] = generate_uuid()
+            parsed_information.append(current_post_info)
+            logger.debug(f"All information has been received on this post(url: {current_post_info['post_url']})")
+            parsed_post_count += 1
         else:
             logger.info(f"{post_count} records were successfully placed in the file!")
 
@@ -233,8 +176,10 @@ def parse_reddit_page(chrome_drive_path: str, post_count: int, logger: logging.L
         logger.error(exception, exc_info=True)
     finally:
         browser.quit()
+        profile_cache.save()
+        logger.info(profile_cache.summary())
         try:
-            asyncio.run(start_sending(parsed_information))
+            asyncio.run(start_sending(parsed_information, batch_sending))
         except aiohttp.ClientOSError:
             pass
 
@@ -244,11 +189,14 @@ async def send_data(url, session, post):
         return await response.read(), response.status
 
 
-async def start_sending(parsed_information):
+async def start_sending(parsed_information, batch_sending=False):
     url = "http://localhost:8087/posts/"
     tasks = []
 
     async with aiohttp.ClientSession() as session:
+        if batch_sending:
+            return await send_data(f"{url}batch", session, parsed_information)
+
         for post in parsed_information:
             task = asyncio.ensure_future(send_data(url, session, post))
             tasks.append(task)
@@ -256,7 +204,7 @@ async def start_sending(parsed_information):
         await asyncio.gather(*tasks)
 
 
-def parse_command_line_arguments() -> Tuple[str, str, int]:
+def parse_command_line_arguments() -> Tuple[str, str, int, bool, str, float]:
     argument_parser = argparse.ArgumentParser(description="Reddit parser")
     argument_parser.add_argument("--path", metavar="path", type=str, help="Chromedriver path",
                                  default=find_chrome_driver())
@@ -265,9 +213,15 @@ def parse_command_line_arguments() -> Tuple[str, str, int]:
                                  help="Minimal logging level('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')")
     argument_parser.add_argument("--post_count", metavar="post_count", type=int, default=50,
                                  choices=range(0, 101), help="Parsed post count")
+    argument_parser.add_argument("--batch", action="store_true",
+                                 help="Send all parsed posts in a single request to the batch endpoint")
+    argument_parser.add_argument("--profile_cache", metavar="profile_cache", type=str, default="profile_cache.json",
+                                 help="File keeping parsed user pages between runs")
+    argument_parser.add_argument("--profile_ttl", metavar="profile_ttl", type=float, default=86400,
+                                 help="Seconds a parsed user page is reused before it is loaded again")
     args = argument_parser.parse_args()
 
-    return args.path, args.log_level, args.post_count
+    return args.path, args.log_level, args.post_count, args.batch, args.profile_cache, args.profile_ttl
 
 
 def find_chrome_driver() -> str:
@@ -283,13 +237,15 @@ def load_xpath_templates_from_json():
 
 
 if __name__ == "__main__":
-    chrome_driver, min_log_level, max_post_count = parse_command_line_arguments()
+    chrome_driver, min_log_level, max_post_count, batch, profile_cache_filename, profile_ttl = \
+        parse_command_line_arguments()
     configured_logger = config_logger(string_to_logging_level(min_log_level))
     xpath = load_xpath_templates_from_json()
 
     if os.path.isfile(chrome_driver):
         start = time.time()
-        parse_reddit_page(chrome_driver, max_post_count, configured_logger, xpath)
+        parse_reddit_page(chrome_driver, max_post_count, configured_logger, xpath, batch,
+                          ProfileCache(profile_cache_filename, profile_ttl))
         print(time.time() - start, " seconds.")
     else:
         configured_logger.error(f"Chrome drive does not exists at this link: {chrome_driver}!")
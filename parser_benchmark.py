@@ -0,0 +1,399 @@
+import argparse
+import asyncio
+import functools
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+from bs4 import BeautifulSoup, NavigableString
+
+from cake_day import parse_cake_day
+from lxml_extraction import CompiledSelectors, get_posts_list, get_profile_block, parse_main_page, parse_user_page
+from offline_parser import extract_snapshots
+from parser import load_xpath_templates_from_json
+from post_feed import PostFeed
+from profile_fetchers import HttpProfileFetcher
+
+# nth-of-type of every div from the body down to the block, as in xpath_config.json
+FEED_BLOCK_PATH = (1, 1, 2, 2, 1, 1, 1, 2, 3, 1, 5)
+PROFILE_BLOCK_PATH = (1, 1, 2, 2, 1, 1, 1, 2, 4, 2, 1, 1, 1, 4)
+MONTHS = ("January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
+          "November", "December")
+POSTS_PLACEHOLDER = "@@posts@@"
+# Templates the selectors benchmark looks up in every post and in every profile block
+POST_TEMPLATES = ("votes_number_inside_post", "top_post_line_block", "comments_number_inside_post")
+PROFILE_TEMPLATES = ("user_karma", "user_cake_day")
+
+
+def nest_in_divs(path, inner_html: str) -> str:
+    """Wrap the html in divs standing at the given nth-of-type positions, outermost first"""
+    for position in reversed(path):
+        inner_html = f"{'<div></div>' * (position - 1)}<div>{inner_html}</div>"
+
+    return inner_html
+
+
+def generate_username(number: int) -> str:
+    # The crawler strips "u/" from names as a set of characters, a leading "u" would be lost
+    return f"redditor{number}"
+
+
+def generate_post_id(number: int) -> str:
+    return f"t3_{number:06x}"
+
+
+def generate_post_html(number: int, randomizer: random.Random, users: int = 200) -> str:
+    """Post laid out the way the selectors of xpath_config.json expect, one in twenty has a deleted user"""
+    post_id = generate_post_id(number)
+    category = f"category{randomizer.randint(0, 50)}"
+    post_url = f"https://www.reddit.com/r/{category}/comments/{number:06x}/"
+    votes = randomizer.randint(0, 200000)
+    votes = str(votes) if votes < 1000 else f"{votes / 1000:.1f}k"
+    username = generate_username(randomizer.randint(0, users - 1))
+    author = "" if number % 20 == 19 else f'<span>Posted by <a href="/user/{username}/">u/{username}</a></span>'
+
+    return (
+        f'<div class="Post scrollerItem" id="{post_id}">'
+        f'<div><div><div>{votes}</div></div></div>'
+        f'<div>'
+        f'<div><div></div><div><div>'
+        f'<a href="/r/{category}/">r/{category}</a>{author}'
+        f'<a href="{post_url}">{randomizer.randint(1, 30)} days ago</a>'
+        f'</div></div></div>'
+        f'<div><h3>Post number {number}</h3></div>'
+        f'<div><a href="{post_url}"><span>{randomizer.randint(0, 5000)} comments</span></a></div>'
+        f'</div>'
+        f'</div>'
+    )
+
+
+def generate_feed_html(posts_html: List[str]) -> str:
+    return f"<html><head></head><body>{nest_in_divs(FEED_BLOCK_PATH, ''.join(posts_html))}</body></html>"
+
+
+def generate_profile_html(randomizer: random.Random) -> str:
+    karma = f"{randomizer.randint(1, 500000):,}"
+    cake_day = f"{randomizer.choice(MONTHS)} {randomizer.randint(1, 28)}, {randomizer.randint(2006, 2020)}"
+    block = f"<div><div><span>{karma}</span></div></div><div><div><span>{cake_day}</span></div></div>"
+    return f"<html><head></head><body>{nest_in_divs(PROFILE_BLOCK_PATH, block)}</body></html>"
+
+
+def generate_popup_html(randomizer: random.Random) -> str:
+    """Inner html of the hover popup of a post, as parse_popup_menu walks it"""
+    karma = "".join(f"<div><div>{randomizer.randint(0, 100000):,}</div><div>{title} Karma</div></div>"
+                    for title in ("Post", "Comment"))
+    return f"<div>Profile</div><div><div><div>Avatar</div>{karma}</div><div></div><div></div></div><div>Follow</div>"
+
+
+def write_fixtures(directory: str, posts: int, users: int = 200, feeds: int = 1) -> None:
+    """Feed pages as feed-<number>.html, the profile of every user as user/<username>.html and the hover popup of
+    every post as popup/<post id>.html, the layout offline_parser reads"""
+    randomizer = random.Random(0)
+    for subdirectory in ("user", "popup"):
+        os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+
+    for feed_number in range(feeds):
+        numbers = range(feed_number * posts, (feed_number + 1) * posts)
+        with open(os.path.join(directory, f"feed-{feed_number:03}.html"), "w") as file:
+            file.write(generate_feed_html([generate_post_html(number, randomizer, users) for number in numbers]))
+
+        for number in numbers:
+            with open(os.path.join(directory, "popup", f"{generate_post_id(number)}.html"), "w") as file:
+                file.write(generate_popup_html(randomizer))
+
+    for number in range(users):
+        with open(os.path.join(directory, "user", f"{generate_username(number)}.html"), "w") as file:
+            file.write(generate_profile_html(randomizer))
+
+    print(f"Fixtures of {feeds} feeds of {posts} posts and {users} users written to {directory}")
+
+
+class FixtureBrowser:
+    """Stands in for the browser with a saved feed, hovering a post reveals the next batch the way scrolling does"""
+
+    def __init__(self, feed_html: str, xpath_templates, batch: int = 25):
+        soup = BeautifulSoup(feed_html, "lxml")
+        feed = soup.select_one(xpath_templates["all_posts_block"])
+        self.posts_html = [str(post) for post in feed.find_all("div", class_="Post")]
+        feed.clear()
+        feed.append(NavigableString(POSTS_PLACEHOLDER))
+        self.page_prefix, self.page_suffix = str(soup).split(POSTS_PLACEHOLDER)
+        self.batch = batch
+        self.visible_posts = 0
+
+    def hover(self, index: int) -> None:
+        self.visible_posts = min(len(self.posts_html), max(self.visible_posts, index + self.batch))
+
+    @property
+    def page_source(self) -> str:
+        return "".join([self.page_prefix, *self.posts_html[:self.visible_posts], self.page_suffix])
+
+    def execute_script(self, _, __, start: int) -> List[str]:
+        return self.posts_html[start:self.visible_posts]
+
+
+def crawl_feed(browser: FixtureBrowser, posts: int, xpath_templates, incremental: bool) -> list:
+    """The listing part of the crawler loop, parsing the whole page per post or only the new posts"""
+    logger = logging.getLogger("parser_benchmark")
+    selectors = CompiledSelectors(xpath_templates)
+    feed = PostFeed(browser, xpath_templates)
+    parsed_posts = []
+    for index in range(posts):
+        browser.hover(index)
+        post = feed[index] if incremental else get_posts_list(browser.page_source, selectors)[index]
+        current_post_info = {}
+        parse_main_page(current_post_info, post, post.get("id"), logger, selectors)
+        parsed_posts.append(current_post_info)
+
+    return parsed_posts
+
+
+def feed_benchmark(feed_filename: str = None, max_posts: int = 800) -> None:
+    xpath_templates = load_xpath_templates_from_json()
+    if feed_filename:
+        with open(feed_filename) as file:
+            feed_html = file.read()
+    else:
+        randomizer = random.Random(0)
+        feed_html = generate_feed_html([generate_post_html(number, randomizer) for number in range(max_posts)])
+
+    available_posts = len(FixtureBrowser(feed_html, xpath_templates).posts_html)
+    posts = min(max_posts, available_posts) // 8
+    while posts <= min(max_posts, available_posts):
+        timings = {}
+        results = {}
+        for incremental in (False, True):
+            browser = FixtureBrowser(feed_html, xpath_templates)
+            start = time.perf_counter()
+            results[incremental] = crawl_feed(browser, posts, xpath_templates, incremental)
+            timings[incremental] = time.perf_counter() - start
+
+        assert results[False] == results[True], "Both listings must extract the same posts"
+        print(f"{posts:5} posts: whole page {timings[False]:7.2f} seconds "
+              f"({timings[False] / posts * 1000:6.2f} ms per post), "
+              f"new posts only {timings[True]:5.2f} seconds ({timings[True] / posts * 1000:5.2f} ms per post)")
+        posts *= 2
+
+
+class FixtureRequestHandler(SimpleHTTPRequestHandler):
+    """Serves the fixtures the way reddit lays out its urls, every response after a simulated network delay"""
+
+    delay = 0
+
+    def translate_path(self, path: str) -> str:
+        user_page = re.fullmatch(r"/user/([^/?]+)/?(\?.*)?", path)
+        if user_page:
+            path = f"/user/{user_page.group(1)}.html"
+
+        return super().translate_path(path)
+
+    def do_GET(self) -> None:
+        time.sleep(self.delay)
+        super().do_GET()
+
+    def log_message(self, *_) -> None:
+        pass
+
+
+class FixtureHTTPServer(ThreadingHTTPServer):
+    # Default backlog of 5 drops connections of a burst of concurrent fetches, the client retries a second later
+    request_queue_size = 128
+
+
+def serve_fixtures(directory: str, delay: float = 0) -> ThreadingHTTPServer:
+    """Fixture server on a free local port, running until it is shut down"""
+    FixtureRequestHandler.delay = delay
+    server = FixtureHTTPServer(("127.0.0.1", 0), functools.partial(FixtureRequestHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def profiles_benchmark(users: int = 200, delay: float = 0.05, concurrency_levels=(1, 4, 16, 64)) -> None:
+    selectors = CompiledSelectors(load_xpath_templates_from_json())
+    logger = logging.getLogger("parser_benchmark")
+    with tempfile.TemporaryDirectory() as directory:
+        write_fixtures(directory, 0, users)
+        server = serve_fixtures(directory, delay)
+        urls = [f"http://127.0.0.1:{server.server_address[1]}/user/{generate_username(number)}/"
+                for number in range(users)]
+        try:
+            for concurrency in concurrency_levels:
+                start = time.perf_counter()
+                user_pages = asyncio.run(HttpProfileFetcher(concurrency).fetch_all(urls))
+                duration = time.perf_counter() - start
+
+                parsed = [parse_user_page(get_profile_block(user_page_html, selectors), url, {}, logger, selectors)
+                          for user_page_html, url in zip(user_pages, urls)]
+                assert all(parsed), "Every fixture profile must be parsed"
+                print(f"Concurrency {concurrency:3}: {users} profiles in {duration:6.2f} seconds, "
+                      f"{users / duration:7.1f} profiles per second")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def offline_benchmark(feeds: int, posts: int, users: int, max_workers: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        write_fixtures(directory, posts, users, feeds)
+        output_filename = os.path.join(directory, "posts.txt")
+
+        workers = 1
+        while workers <= max_workers:
+            start = time.perf_counter()
+            written_posts = extract_snapshots(directory, output_filename, workers)
+            duration = time.perf_counter() - start
+            print(f"{workers:3} workers: {written_posts} posts in {duration:6.2f} seconds, "
+                  f"{written_posts / duration:7.1f} posts per second")
+            workers *= 2
+
+
+def select_posts_with_soup(feed_html: str, xpath_templates) -> list:
+    feed = BeautifulSoup(feed_html, "lxml").select_one(xpath_templates["all_posts_block"])
+    return [[post.select_one(xpath_templates[name]).get_text() for name in POST_TEMPLATES]
+            for post in feed.find_all("div", class_="Post")]
+
+
+def select_profiles_with_soup(profiles_html: List[str], xpath_templates) -> list:
+    profile_blocks = [BeautifulSoup(profile_html, "lxml").select_one(xpath_templates["user_profile_block"])
+                      for profile_html in profiles_html]
+    return [[profile_block.select_one(xpath_templates[name]).get_text() for name in PROFILE_TEMPLATES]
+            for profile_block in profile_blocks]
+
+
+def select_posts_with_compiled_selectors(feed_html: str, selectors: CompiledSelectors) -> list:
+    return [[selectors.select_one(name, post).text_content() for name in POST_TEMPLATES]
+            for post in get_posts_list(feed_html, selectors)]
+
+
+def select_profiles_with_compiled_selectors(profiles_html: List[str], selectors: CompiledSelectors) -> list:
+    profile_blocks = [get_profile_block(profile_html, selectors) for profile_html in profiles_html]
+    return [[selectors.select_one(name, profile_block).text_content() for name in PROFILE_TEMPLATES]
+            for profile_block in profile_blocks]
+
+
+def selectors_benchmark(posts: int, users: int, repeats: int = 3) -> None:
+    """Per post time of the template lookups with select_one on soup against compiled selectors on lxml, both
+    including the parse of the page"""
+    xpath_templates = load_xpath_templates_from_json()
+    randomizer = random.Random(0)
+    feed_html = generate_feed_html([generate_post_html(number, randomizer, users) for number in range(posts)])
+    profiles_html = [generate_profile_html(randomizer) for _ in range(posts)]
+
+    start = time.perf_counter()
+    selectors = CompiledSelectors(xpath_templates)
+    print(f"Templates compiled in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    for page, source, soup_path, compiled_path in (
+            ("main page", feed_html, select_posts_with_soup, select_posts_with_compiled_selectors),
+            ("user page", profiles_html, select_profiles_with_soup, select_profiles_with_compiled_selectors)):
+        timings, results = {}, {}
+        for name, extract, templates in (("soup", soup_path, xpath_templates), ("compiled", compiled_path, selectors)):
+            timings[name] = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                results[name] = extract(source, templates)
+                timings[name].append(time.perf_counter() - start)
+
+        assert results["soup"] == results["compiled"], "Both paths must select the same elements"
+        soup_time, compiled_time = min(timings["soup"]) / posts, min(timings["compiled"]) / posts
+        print(f"{page}: soup {soup_time * 10 ** 6:7.1f} us per post, compiled {compiled_time * 10 ** 6:7.1f} us "
+              f"per post, {soup_time / compiled_time:.1f}x")
+
+
+def generate_cake_days(count: int, randomizer: random.Random) -> List[str]:
+    """Cake days as profiles show them, mostly the full month name, some abbreviated, from reddit's start until now"""
+    cake_days = []
+    for _ in range(count):
+        day = time.localtime(randomizer.randint(1119000000, 1600000000))
+        month = MONTHS[day.tm_mon - 1] if randomizer.random() < 0.9 else MONTHS[day.tm_mon - 1][:3]
+        cake_days.append(f"{month} {day.tm_mday}, {day.tm_year}")
+
+    return cake_days
+
+
+def measure_import(module: str, repeats: int = 5) -> float:
+    """Seconds a fresh interpreter spends importing the module"""
+    timings = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", f"import time; start = time.perf_counter(); import {module}; "
+                                                       f"print(time.perf_counter() - start)"],
+                                check=True, capture_output=True, text=True).stdout
+        timings.append(float(output))
+
+    return min(timings)
+
+
+def cake_day_benchmark(count: int) -> None:
+    import dateparser
+
+    cake_days = generate_cake_days(count, random.Random(0))
+    print(f"{count} cake days, {len(set(cake_days))} distinct")
+
+    start = time.perf_counter()
+    expected = [str(dateparser.parse(cake_day).date()) for cake_day in cake_days]
+    dateparser_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for cake_day in cake_days:
+        parse_cake_day.__wrapped__(cake_day)
+    strict_time = time.perf_counter() - start
+
+    parse_cake_day.cache_clear()
+    start = time.perf_counter()
+    parsed = [parse_cake_day(cake_day) for cake_day in cake_days]
+    cold_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for cake_day in cake_days:
+        parse_cake_day(cake_day)
+    warm_time = time.perf_counter() - start
+
+    assert parsed == expected, "Both parsers must read the same dates"
+    for name, duration in (("dateparser", dateparser_time), ("strict formats", strict_time),
+                           ("memoized, first pass", cold_time), ("memoized, all seen", warm_time)):
+        print(f"{name:>20}: {duration / count * 10 ** 6:8.2f} us per cake day")
+
+    print(f"Import: dateparser {measure_import('dateparser') * 1000:.1f} ms, "
+          f"cake_day {measure_import('cake_day') * 1000:.1f} ms")
+
+
+def parse_command_line_arguments() -> argparse.Namespace:
+    argument_parser = argparse.ArgumentParser(description="Crawler extraction benchmarks on saved pages")
+    argument_parser.add_argument("mode", choices=["fixtures", "feed", "profiles", "offline", "selectors", "cake_day"])
+    argument_parser.add_argument("--posts", metavar="posts", type=int, default=800)
+    argument_parser.add_argument("--feeds", metavar="feeds", type=int, default=1,
+                                 help="Saved feed pages, each of --posts posts")
+    argument_parser.add_argument("--max_workers", metavar="max_workers", type=int, default=os.cpu_count(),
+                                 help="Highest number of offline extraction processes, doubled from 1")
+    argument_parser.add_argument("--users", metavar="users", type=int, default=200)
+    argument_parser.add_argument("--directory", metavar="directory", type=str, default="fixtures",
+                                 help="Where fixtures are written")
+    argument_parser.add_argument("--delay", metavar="delay", type=float, default=0.05,
+                                 help="Seconds the fixture server waits before every response")
+    argument_parser.add_argument("--feed", metavar="feed", type=str, default=None,
+                                 help="Saved feed page, a generated one is used by default")
+
+    return argument_parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_command_line_arguments()
+    if arguments.mode == "fixtures":
+        write_fixtures(arguments.directory, arguments.posts, arguments.users, arguments.feeds)
+    elif arguments.mode == "offline":
+        offline_benchmark(arguments.feeds, arguments.posts, arguments.users, arguments.max_workers)
+    elif arguments.mode == "cake_day":
+        cake_day_benchmark(arguments.posts * 10)
+    elif arguments.mode == "selectors":
+        selectors_benchmark(arguments.posts, arguments.users)
+    elif arguments.mode == "profiles":
+        profiles_benchmark(arguments.users, arguments.delay)
+    else:
+        feed_benchmark(arguments.feed, arguments.posts)
@@ -0,0 +1,45 @@
+from lxml import html
+
+from lxml_extraction import POSTS
+
+# Outer HTML of the posts of the feed from the given position on, the ones before it never leave the browser
+NEW_POSTS_SCRIPT = """
+const feed = document.querySelector(arguments[0]);
+if (feed === null) {
+    return [];
+}
+return Array.from(feed.querySelectorAll("div.Post")).slice(arguments[1]).map(post => post.outerHTML);
+"""
+
+
+class PostFeed:
+    """Posts of the feed in the order they appeared on the page.
+
+    The page is asked for posts only when the crawler gets past the parsed ones, and then only for the posts that
+    appeared since, so every post is transferred and parsed once however long the feed grows.
+    """
+
+    def __init__(self, browser, xpath_templates):
+        self.browser = browser
+        self.feed_selector = xpath_templates["all_posts_block"]
+        self.posts = []
+
+    def __len__(self):
+        return len(self.posts)
+
+    def __getitem__(self, index):
+        if index >= len(self.posts):
+            self.refresh()
+
+        return self.posts[index]
+
+    def refresh(self) -> int:
+        """Parse the posts that appeared since the last refresh, returns their number"""
+        new_posts = self.browser.execute_script(NEW_POSTS_SCRIPT, self.feed_selector, len(self.posts))
+        self.posts += [parse_post_html(post_html) for post_html in new_posts]
+        return len(new_posts)
+
+
+def parse_post_html(post_html: str):
+    # Post selectors look up to two levels above the post, in the feed those are divs as well
+    return POSTS(html.fragment_fromstring(f"<div><div>{post_html}</div></div>"))[0]
@@ -0,0 +1,133 @@
+import sys
+
+POST_FIELDS = (
+    "unique_id", "post_url", "username", "user_karma", "user_cake_day", "post_karma", "comment_karma",
+    "post_date", "comments_number", "votes_number", "post_category"
+)
+# Counters scraped from the page, stored as ints whenever the text is a plain integer
+NUMERIC_FIELDS = ("user_karma", "post_karma", "comment_karma", "comments_number", "votes_number")
+# Values repeated across many posts, every distinct one is stored once
+INTERNED_FIELDS = ("username", "user_cake_day", "post_date", "post_category")
+_post_fields = frozenset(POST_FIELDS)
+# Field separator and line breaks of the posts files and logs, text holding one would split its record
+RESERVED_CHARACTERS = frozenset(";\n\r")
+
+
+class PostRecord:
+    """A post in fixed slots instead of a dict of strings.
+
+    Numeric fields are read as attributes in their typed form, while item access, to_dict and JSON give back the
+    same text the post came with.
+    """
+
+    __slots__ = POST_FIELDS
+
+    def __init__(self, unique_id, post_url, username, user_karma, user_cake_day, post_karma, comment_karma,
+                 post_date, comments_number, votes_number, post_category):
+        self.unique_id = unique_id
+        self.post_url = post_url
+        self.username = intern_text(username)
+        self.user_karma = compact_number(user_karma)
+        self.user_cake_day = intern_text(user_cake_day)
+        self.post_karma = compact_number(post_karma)
+        self.comment_karma = compact_number(comment_karma)
+        self.post_date = intern_text(post_date)
+        self.comments_number = compact_number(comments_number)
+        self.votes_number = compact_number(votes_number)
+        self.post_category = intern_text(post_category)
+
+    @classmethod
+    def from_values(cls, values: list) -> "PostRecord":
+        """Build a record from the fields in file order, missing trailing fields are left empty"""
+        if len(values) != len(POST_FIELDS):
+            values = (list(values) + [""] * len(POST_FIELDS))[:len(POST_FIELDS)]
+
+        return cls(*values)
+
+    @classmethod
+    def from_mapping(cls, post, unique_id: str = None) -> "PostRecord":
+        """Build a record from a post received as an object, raises ValueError for values that are neither text nor
+        integers or that hold a reserved character, they could not be written to the posts file"""
+        if isinstance(post, cls) and unique_id in (None, post.unique_id):
+            return post
+
+        values = [post.get(field, "") for field in POST_FIELDS]
+        if unique_id is not None:
+            values[0] = unique_id
+        # Ids are compared with each other when kept in order, an integer among them would break that
+        if type(values[0]) is not str:
+            raise ValueError(f"Unique id of a post must be text, not {type(values[0]).__name__}")
+        for field, value in zip(POST_FIELDS, values):
+            if not is_field_value(value):
+                raise ValueError(f"Field {field} of a post must be text without ';' or line breaks or an integer, "
+                                 f"not {value!r}")
+
+        return cls(*values)
+
+    def __getitem__(self, field: str):
+        if field not in _post_fields:
+            raise KeyError(field)
+
+        value = getattr(self, field)
+        return str(value) if type(value) is int else value
+
+    def get(self, field: str, default=None):
+        return self[field] if field in _post_fields else default
+
+    def keys(self) -> tuple:
+        return POST_FIELDS
+
+    def values(self) -> list:
+        return [self[field] for field in POST_FIELDS]
+
+    def to_dict(self) -> dict:
+        return dict(zip(POST_FIELDS, self.values()))
+
+    def memory_size(self) -> int:
+        """Bytes of the record and its values, interned values are counted as if they were not shared"""
+        return sys.getsizeof(self) + sum(sys.getsizeof(getattr(self, field)) for field in POST_FIELDS)
+
+    def __eq__(self, other):
+        if not isinstance(other, PostRecord):
+            return NotImplemented
+
+        return self.values() == other.values()
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return PostRecord, tuple(getattr(self, field) for field in POST_FIELDS)
+
+    def __repr__(self):
+        return f"PostRecord({self.to_dict()!r})"
+
+
+def is_field_value(value) -> bool:
+    if type(value) is str:
+        return RESERVED_CHARACTERS.isdisjoint(value)
+
+    return type(value) is int
+
+
+def has_valid_fields(post) -> bool:
+    return all(is_field_value(post.get(field, "")) for field in POST_FIELDS)
+
+
+def compact_number(value):
+    """"42" becomes 42, anything that would not read back the same ("1,234", "12.5k", "007") stays text"""
+    if type(value) is str and value.isascii() and value.isdigit() and (value[0] != "0" or value == "0"):
+        return int(value)
+
+    return value
+
+
+def intern_text(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+def json_default(value):
+    """Hook for json.dumps, posts are written as the objects they were received as"""
+    if isinstance(value, PostRecord):
+        return value.to_dict()
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,87 @@
+import bisect
+import re
+import threading
+
+COUNTER_SUFFIXES = {"": 1, "k": 10 ** 3, "m": 10 ** 6, "b": 10 ** 9}
+COUNTER_PATTERN = re.compile(r"(-?[\d.]+)\s*([kmb]?)")
+# Upper bounds of the user karma buckets, the last bucket has no bound
+KARMA_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+
+
+def parse_counter(value) -> int:
+    """Turn counters the way reddit shows them ("42", "1,234", "12.5k", "1.2m") into numbers, anything else is 0"""
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    match = COUNTER_PATTERN.fullmatch(str(value).strip().lower().replace(",", ""))
+    if match is None:
+        return 0
+
+    try:
+        return round(float(match.group(1)) * COUNTER_SUFFIXES[match.group(2)])
+    except ValueError:
+        return 0
+
+
+class PostStatistics:
+    """Running aggregates over the posts in the cache, updated on every mutation instead of recomputed per query"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._categories = {}
+        self._posts = 0
+        self._votes = 0
+        self._karma_total = 0
+        self._karma_buckets = [0] * (len(KARMA_BUCKETS) + 1)
+
+    def add(self, post):
+        self._update(post, 1)
+
+    def remove(self, post):
+        self._update(post, -1)
+
+    def _update(self, post, sign):
+        votes = parse_counter(post.votes_number)
+        karma = parse_counter(post.user_karma)
+        with self._lock:
+            category = self._categories.setdefault(post.post_category, {"posts": 0, "votes": 0})
+            category["posts"] += sign
+            category["votes"] += sign * votes
+            if category["posts"] == 0:
+                del self._categories[post.post_category]
+
+            self._posts += sign
+            self._votes += sign * votes
+            self._karma_total += sign * karma
+            self._karma_buckets[bisect.bisect_left(KARMA_BUCKETS, karma)] += sign
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "posts": self._posts,
+                "votes_total": self._votes,
+                "votes_average": average(self._votes, self._posts),
+                "categories": {
+                    category: {"posts": values["posts"], "votes_total": values["votes"],
+                               "votes_average": average(values["votes"], values["posts"])}
+                    for category, values in self._categories.items()
+                },
+                "user_karma": {
+                    "total": self._karma_total,
+                    "average": average(self._karma_total, self._posts),
+                    "buckets": {
+                        bucket_name(number): count for number, count in enumerate(self._karma_buckets)
+                    },
+                },
+            }
+
+
+def average(total, count) -> float:
+    return round(total / count, 2) if count else 0
+
+
+def bucket_name(number: int) -> str:
+    if number == len(KARMA_BUCKETS):
+        return f">{KARMA_BUCKETS[-1]}"
+
+    return f"<={KARMA_BUCKETS[number]}"
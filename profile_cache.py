@@ -0,0 +1,72 @@
+import json
+import os
+import time
+from typing import Dict
+
+PROFILE_FIELDS = ("user_karma", "user_cake_day")
+
+
+class ProfileCache:
+    """Fields of user pages parsed in this and earlier runs, a user found here is not loaded again until the entry
+    is `ttl` seconds old.
+
+    Entries live in a JSON file, written back at the end of a run together with the ones other runs saved meanwhile.
+    """
+
+    def __init__(self, filename: str = "profile_cache.json", ttl: float = 86400):
+        self.filename = filename
+        self.ttl = ttl
+        # username -> {"user_karma": ..., "user_cake_day": ..., "fetched_at": timestamp}
+        self._profiles = self._read_entries()
+        self.hits = 0
+        self.misses = 0
+
+    def _read_entries(self) -> Dict[str, dict]:
+        if not os.path.isfile(self.filename):
+            return {}
+
+        with open(self.filename, "r") as file:
+            try:
+                return json.load(file)
+            except json.JSONDecodeError:
+                return {}
+
+    def _expired(self, profile: dict) -> bool:
+        return time.time() - profile["fetched_at"] > self.ttl
+
+    def get(self, username: str) -> Dict[str, str] or None:
+        profile = self._profiles.get(username)
+        if profile is None or self._expired(profile):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return {field: profile[field] for field in PROFILE_FIELDS}
+
+    def put(self, username: str, post_info: Dict[str, str]) -> None:
+        self._profiles[username] = {field: post_info[field] for field in PROFILE_FIELDS}
+        self._profiles[username]["fetched_at"] = time.time()
+
+    def save(self) -> None:
+        """Write the entries that have not expired, the newer one wins where another run saved the same user"""
+        profiles = self._read_entries()
+        for username, profile in self._profiles.items():
+            if username not in profiles or profiles[username]["fetched_at"] < profile["fetched_at"]:
+                profiles[username] = profile
+        profiles = {username: profile for username, profile in profiles.items() if not self._expired(profile)}
+
+        temporary_filename = f"{self.filename}.tmp"
+        with open(temporary_filename, "w") as file:
+            json.dump(profiles, file)
+        os.replace(temporary_filename, self.filename)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self) -> str:
+        return f"Profile cache: {self.hits} hits, {self.misses} misses, hit rate {self.hit_rate():.1%}"
+
+
+def username_from_url(user_page_url: str) -> str:
+    return user_page_url.rstrip("/").split("/")[-1]
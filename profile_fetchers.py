@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from typing import List
+
+import aiohttp
+
+# Profile pages are server rendered, a plain request gets the same markup the browser shows
+REQUEST_HEADERS = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                                 "Chrome/90.0.4430.93 Safari/537.36"}
+
+
+class HttpProfileFetcher:
+    """Profile pages over plain HTTP, requests run concurrently with at most `concurrency` of them in flight"""
+
+    def __init__(self, concurrency: int = 8, timeout: float = 30, logger: logging.Logger = None):
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.logger = logger or logging.getLogger("reddit_parser")
+
+    async def fetch_all(self, urls: List[str]) -> List[str or None]:
+        """Html of every page in the order of the urls, None for the ones that could not be fetched"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async with aiohttp.ClientSession(headers=REQUEST_HEADERS, timeout=self.timeout) as session:
+            return await asyncio.gather(*[self._fetch(session, semaphore, url) for url in urls])
+
+    async def _fetch(self, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, url: str) -> str or None:
+        async with semaphore:
+            try:
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    return await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exception:
+                self.logger.debug(f"Failed to fetch user page(link: {url}): {exception!r}")
+                return None
+
+
+class BrowserProfileFetcher:
+    """Profile pages opened one after another in a second tab of the crawler's browser.
+
+    A browser drives one tab at a time, so this is sequential, it is kept for pages that need scripts to render.
+    """
+
+    def __init__(self, browser, page_load_delay: float = 1):
+        self.browser = browser
+        self.page_load_delay = page_load_delay
+
+    async def fetch_all(self, urls: List[str]) -> List[str or None]:
+        return [await self._fetch(url) for url in urls]
+
+    async def _fetch(self, url: str) -> str:
+        self.browser.execute_script(f"window.open('{url}');")
+        await asyncio.sleep(self.page_load_delay)
+        self.browser.switch_to.window(self.browser.window_handles[1])
+        user_page_html = self.browser.page_source
+
+        self.browser.close()
+        self.browser.switch_to.window(self.browser.window_handles[0])
+        return user_page_html
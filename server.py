@@ -1,147 +1,216 @@
 import argparse
-import json
+import asyncio
 import logging
+import multiprocessing
+import os
+import socket
+import tempfile
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-from typing import Tuple
+from types import GeneratorType
+from typing import Iterator
 
+from async_server import serve_async
 from cache import Cache
+from cache_sharing import serve_cache, connect_cache, merge_metrics_periodically
+from endpoints import PostsEndpoints, parse_request_body, encode_json_body, body_allowed
 from logging_converter import string_to_logging_level
-from url_processing import find_matches, get_unique_id_from_url
+from storage import create_storage, STORAGE_ENGINES
 
 
-class CustomHTTPRequestHandler(BaseHTTPRequestHandler):
-    cache = Cache()
+class CustomHTTPRequestHandler(PostsEndpoints, BaseHTTPRequestHandler):
+    # Persistent connections, every response carries Content-Length so that the next request can follow it
+    protocol_version = "HTTP/1.1"
+    # Seconds an idle keep-alive connection is held open
+    timeout = 30
+    # Headers and body are separate writes, Nagle would hold the body back until the client acknowledges
+    disable_nagle_algorithm = True
 
-    def __init__(self, *args, **kwargs):
-        self.possible_endpoints = {
-            ("GET", r"/posts/?"): self.get_all_posts_request,
-            ("GET", r"/posts/.{32}/?"): self.get_single_post_request,
-            ("POST", r"/posts/?"): self.post_request,
-            ("DELETE", r"/posts/.{32}/?"): self.delete_request,
-            ("PUT", r"/posts/.{32}/?"): self.put_request
-        }
-        super().__init__(*args, **kwargs)
+    def _get_request_body(self) -> dict or list:
+        content_length = int(self.headers.get('Content-Length', 0))
+        return parse_request_body(self.headers, self.rfile.read(content_length))
 
-    def request_handler(self, command: str, uri: str):
-        possible_endpoint = list(filter(lambda key: key[0] == command, self.possible_endpoints))
-        return self.possible_endpoints.get(find_matches(possible_endpoint, uri))
+    def _set_response(self, status_code: int, name: str, body=None, headers=None) -> None:
+        if isinstance(body, GeneratorType):
+            self.record_request(status_code, self._set_streamed_response(status_code, name, body))
+            return
 
-    def _get_request_body(self) -> dict:
-        content_length = int(self.headers['Content-Length'])
-        return json.loads(self.rfile.read(content_length).decode("utf-8"))
-
-    def _set_response(self, status_code: int, name: str, body=None) -> None:
+        encoded_body = encode_json_body(body) if body_allowed(status_code) else b""
+        headers = dict(headers or {})
+        content_type = headers.pop('Content-Type', 'application/json')
+        self.send_response(status_code, name)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        if body_allowed(status_code):
+            self.send_header('Content-Length', str(len(encoded_body)))
+        self._set_content_type(content_type)
+        self.wfile.write(encoded_body)
+        self.record_request(status_code, len(encoded_body))
+
+    def _set_streamed_response(self, status_code: int, name: str, chunks: Iterator[bytes]) -> int:
+        """Write the body as it is produced, returns its size"""
         self.send_response(status_code, name)
+        # HTTP/1.0 clients know nothing about chunks, for them the end of the body is the end of the connection
+        chunked = self.request_version != "HTTP/1.0"
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.close_connection = True
         self._set_content_type()
-        if body:
-            self.wfile.write(json.dumps(body).encode("utf-8"))
 
-    def _set_content_type(self) -> None:
-        self.send_header('Content-Type', 'application/json')
+        body_size = 0
+        for chunk in chunks:
+            # Empty chunk would mark the end of the body
+            if not chunk:
+                continue
+
+            body_size += len(chunk)
+            if chunked:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            else:
+                self.wfile.write(chunk)
+
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+        return body_size
+
+    def _set_content_type(self, content_type: str = 'application/json') -> None:
+        self.send_header('Content-Type', content_type)
         self.end_headers()
 
     def do_GET(self) -> None:
         logging.info(f"GET request, Path: {self.path}")
-        get_method = self.request_handler(self.command, self.path)
-
-        if get_method:
-            self._set_response(*get_method())
-        else:
-            self._set_response(404, "Not Found")
+        self._set_response(*self.dispatch_request())
 
     def do_POST(self) -> None:
         post_data = self._get_request_body()
         logging.info(f"POST request, Path: {str(self.path)}, Body: {post_data}")
-        post_method = self.request_handler(self.command, self.path)
-
-        if post_method:
-            self._set_response(*post_method(post_data))
-        else:
-            self._set_response(200, "OK")
+        self._set_response(*self.dispatch_request(post_data))
 
     def do_DELETE(self) -> None:
         logging.info(f"DELETE request, Path: {self.path}")
-        delete_method = self.request_handler(self.command, self.path)
-
-        if delete_method:
-            self._set_response(*delete_method())
-        else:
-            self._set_response(404, "Not Found")
+        self._set_response(*self.dispatch_request())
 
     def do_PUT(self) -> None:
         post_data = self._get_request_body()
         logging.info(f"PUT request, Path: {str(self.path)}, Body: {post_data}")
-        put_method = self.request_handler(self.command, self.path)
-
-        if put_method:
-            self._set_response(*put_method(post_data))
-        else:
-            self._set_response(404, "Not Found")
-
-    def get_all_posts_request(self) -> Tuple[int, str, list]:
-        file_content = self.cache.get_all_posts()
-        return 200, "OK", file_content
+        self._set_response(*self.dispatch_request(post_data))
 
-    def get_single_post_request(self):
-        unique_id = get_unique_id_from_url(self.path)
-        post = self.cache.get_post_by_id(unique_id)
-
-        if post is not None:
-            return 200, "OK", post
-        else:
-            return 404, "Not Found"
-
-    def post_request(self, post_data: dict):
-        unique_id = post_data["unique_id"]
-        if not self.cache.get_post_by_id(unique_id):
-            self.cache.append(unique_id, post_data)
-            line_number = self.cache.cache_size()
-            return 201, "Created", {unique_id: line_number}
-        else:
-            return 200, "OK"
 
-    def delete_request(self) -> Tuple[int, str]:
-        unique_id = get_unique_id_from_url(self.path)
-        if self.cache.delete(unique_id):
-            return 200, "OK"
-        else:
-            return 205, "No Content"
+class ReusePortHTTPServer(ThreadingHTTPServer):
+    """Every worker binds its own socket to the shared port and the kernel spreads connections between them"""
 
-    def put_request(self, post_data: dict) -> Tuple[int, str]:
-        unique_id = get_unique_id_from_url(self.path)
-        if self.cache.get_post_by_id(unique_id):
-            self.cache.modify(unique_id, post_data)
-            return 200, "OK"
-        else:
-            return 205, "No Content"
+    def server_bind(self) -> None:
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
 
 
-def parse_command_line_arguments() -> tuple:
+def parse_command_line_arguments() -> argparse.Namespace:
     argument_parser = argparse.ArgumentParser(description="Simple http server")
     argument_parser.add_argument("--port", metavar="port", type=int, default=8087)
     argument_parser.add_argument("--log_level", metavar="log_level", type=str, default="CRITICAL",
                                  choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                                  help="Minimal logging level('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')")
-    args = argument_parser.parse_args()
+    argument_parser.add_argument("--engine", metavar="engine", type=str, default="threading",
+                                 choices=["threading", "asyncio"],
+                                 help="Thread per connection or a single asyncio event loop('threading', 'asyncio')")
+    argument_parser.add_argument("--flush_interval", metavar="flush_interval", type=float, default=1,
+                                 help="Seconds between writes of queued cache changes to the log")
+    argument_parser.add_argument("--dirty_threshold", metavar="dirty_threshold", type=int, default=1000,
+                                 help="Queued cache changes that trigger a write before the interval expires")
+    argument_parser.add_argument("--compaction_interval", metavar="compaction_interval", type=float, default=120,
+                                 help="Seconds between snapshots of the cache")
+    argument_parser.add_argument("--idle_timeout", metavar="idle_timeout", type=float, default=30,
+                                 help="Seconds an idle keep-alive connection is held open")
+    argument_parser.add_argument("--shutdown_timeout", metavar="shutdown_timeout", type=float, default=10,
+                                 help="Seconds given to the final cache snapshot on shutdown")
+    argument_parser.add_argument("--max_posts", metavar="max_posts", type=int, default=None,
+                                 help="Posts kept in memory, the least recently used ones are read from disk")
+    argument_parser.add_argument("--max_bytes", metavar="max_bytes", type=int, default=None,
+                                 help="Estimated bytes of posts kept in memory")
+    argument_parser.add_argument("--storage", metavar="storage", type=str, default="segmented",
+                                 choices=list(STORAGE_ENGINES),
+                                 help="Engine the posts are persisted with('segmented', 'text', 'sqlite')")
+    argument_parser.add_argument("--database", metavar="database", type=str, default=None,
+                                 help="Manifest of the segmented engine or file of the others")
+    argument_parser.add_argument("--workers", metavar="workers", type=int, default=1,
+                                 help="Server processes sharing the port, the cache stays in the primary process")
+
+    arguments = argument_parser.parse_args()
+    if arguments.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        argument_parser.error("--workers needs SO_REUSEPORT, which this platform does not provide")
+
+    return arguments
+
+
+def run_server(port, server_class=ThreadingHTTPServer, handler_class=CustomHTTPRequestHandler,
+               flush_interval=1, dirty_threshold=1000, compaction_interval=120, shutdown_timeout=10, idle_timeout=30,
+               engine="threading", workers=1, max_posts=None, max_bytes=None, storage="segmented", database=None):
+    PostsEndpoints.cache = cache = Cache(max_posts=max_posts, max_bytes=max_bytes,
+                                         storage=create_storage(storage, database))
+    # Unix socket of the cache manager, removed by the manager on exit, and the key the workers authenticate with
+    cache_address = (os.path.join(tempfile.gettempdir(), f"reddit-cache-{os.getpid()}.sock"), os.urandom(16))
+    # Workers are forked before the flusher and the cache manager start any thread
+    worker_processes = [start_worker(port, handler_class, idle_timeout, engine, cache_address)
+                        for _ in range(workers if workers > 1 else 0)]
+    cache.start_flusher(flush_interval, dirty_threshold, compaction_interval)
+    try:
+        logging.info(f"Start {engine} server on port {port}")
+        if worker_processes:
+            serve_cache(cache, *cache_address)
+            for worker_process in worker_processes:
+                worker_process.join()
+        elif engine == "asyncio":
+            asyncio.run(serve_async(port, idle_timeout))
+        else:
+            run_threading_server(port, server_class, handler_class, idle_timeout)
+    except KeyboardInterrupt as exception:
+        logging.error(exception)
+    finally:
+        for worker_process in worker_processes:
+            worker_process.terminate()
+            worker_process.join()
+        cache.stop_flusher(shutdown_timeout)
+        logging.info(f"Server closed on port {port}")
 
-    return args.port, args.log_level
 
+def start_worker(port, handler_class, idle_timeout, engine, cache_address) -> multiprocessing.Process:
+    worker_process = multiprocessing.get_context("fork").Process(
+        target=run_worker, args=(port, handler_class, idle_timeout, engine, cache_address), daemon=True
+    )
+    worker_process.start()
+    return worker_process
 
-def run_server(port, server_class=ThreadingHTTPServer, handler_class=CustomHTTPRequestHandler):
+
+def run_worker(port, handler_class, idle_timeout, engine, cache_address):
+    # The copy of the cache inherited through fork is never used, every call goes to the primary process
+    PostsEndpoints.cache, PostsEndpoints.metrics = connect_cache(*cache_address)
+    merge_metrics_periodically(PostsEndpoints.metrics)
+    try:
+        logging.info(f"Start {engine} worker {os.getpid()} on port {port}")
+        if engine == "asyncio":
+            # Every cache call is a round trip to the primary process, made off the event loop
+            asyncio.run(serve_async(port, idle_timeout, reuse_port=True, offload=True))
+        else:
+            run_threading_server(port, ReusePortHTTPServer, handler_class, idle_timeout)
+    except KeyboardInterrupt:
+        pass
+
+
+def run_threading_server(port, server_class, handler_class, idle_timeout):
     server_address = ('', port)
+    handler_class.timeout = idle_timeout
     httpd = server_class(server_address, handler_class)
     try:
-        logging.info(f"Start server on port {port}")
         httpd.serve_forever()
-    except KeyboardInterrupt as exception:
-        logging.error(exception)
     finally:
         httpd.server_close()
-        httpd.RequestHandlerClass.cache.backup_cache()
-        logging.info(f"Server closed on port {port}")
 
 
 if __name__ == '__main__':
-    port_number, logging_level = parse_command_line_arguments()
-    logging.basicConfig(level=string_to_logging_level(logging_level))
-    run_server(port_number)
+    arguments = parse_command_line_arguments()
+    logging.basicConfig(level=string_to_logging_level(arguments.log_level))
+    run_server(arguments.port, flush_interval=arguments.flush_interval, dirty_threshold=arguments.dirty_threshold,
+               compaction_interval=arguments.compaction_interval, shutdown_timeout=arguments.shutdown_timeout,
+               idle_timeout=arguments.idle_timeout, engine=arguments.engine, workers=arguments.workers,
+               max_posts=arguments.max_posts, max_bytes=arguments.max_bytes, storage=arguments.storage,
+               database=arguments.database)
@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import http.client
+import json
+import multiprocessing
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from http.server import ThreadingHTTPServer
+
+SAMPLE_REQUESTS = [
+    ("GET", "/posts/"),
+    ("GET", "/posts/0123456789abcdef0123456789abcdef"),
+    ("POST", "/posts/"),
+    ("DELETE", "/posts/0123456789abcdef0123456789abcdef/"),
+    ("PUT", "/posts/0123456789abcdef0123456789abcdef"),
+    ("GET", "/unknown/"),
+]
+
+
+class LegacyDispatcher:
+    """The dispatch as it was before the router: endpoints rebuilt per request and matched with re.fullmatch"""
+
+    def __init__(self):
+        self.possible_endpoints = {
+            ("GET", r"/posts/?"): self.endpoint,
+            ("GET", r"/posts/.{32}/?"): self.endpoint,
+            ("POST", r"/posts/?"): self.endpoint,
+            ("DELETE", r"/posts/.{32}/?"): self.endpoint,
+            ("PUT", r"/posts/.{32}/?"): self.endpoint
+        }
+
+    def endpoint(self):
+        pass
+
+    def request_handler(self, command: str, uri: str):
+        possible_endpoint = list(filter(lambda key: key[0] == command, self.possible_endpoints))
+        endpoint_key = self.find_matches(possible_endpoint, uri)
+        # Handlers of single posts used to pull the id out of the path themselves
+        if endpoint_key is not None and ".{32}" in endpoint_key[1]:
+            uri.split("/")[2]
+
+        return self.possible_endpoints.get(endpoint_key)
+
+    @staticmethod
+    def find_matches(possible_endpoints, uri):
+        for key in possible_endpoints:
+            if re.fullmatch(key[1], uri):
+                return key
+
+
+def dispatch_benchmark(repeat: int) -> None:
+    from server import CustomHTTPRequestHandler
+
+    # Handler is never bound to a socket, only its dispatch is exercised
+    handler = CustomHTTPRequestHandler.__new__(CustomHTTPRequestHandler)
+
+    def legacy_dispatch():
+        for command, uri in SAMPLE_REQUESTS:
+            LegacyDispatcher().request_handler(command, uri)
+
+    def router_dispatch():
+        for command, uri in SAMPLE_REQUESTS:
+            handler.request_handler(command, uri)
+
+    for name, dispatch in (("legacy", legacy_dispatch), ("router", router_dispatch)):
+        elapsed = min(timeit.repeat(dispatch, number=repeat, repeat=5))
+        print(f"{name:>8}: {elapsed / (repeat * len(SAMPLE_REQUESTS)) * 10 ** 6:.2f} microseconds per request")
+
+
+def start_server(handler_class) -> ThreadingHTTPServer:
+    httpd = ThreadingHTTPServer(("localhost", 0), handler_class)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def quiet_handler_class(protocol_version: str):
+    from server import CustomHTTPRequestHandler
+
+    class QuietHTTPRequestHandler(CustomHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    QuietHTTPRequestHandler.protocol_version = protocol_version
+    return QuietHTTPRequestHandler
+
+
+def read_response(response_file) -> int:
+    """Read one response off a pipelined connection, relying on Content-Length framing"""
+    status_code = int(response_file.readline().split()[1])
+    content_length = 0
+    for header in iter(response_file.readline, b"\r\n"):
+        name, value = header.decode("latin-1").split(":", 1)
+        if name.lower() == "content-length":
+            content_length = int(value)
+
+    response_file.read(content_length)
+    return status_code
+
+
+def requests_per_second(send_requests, requests: int) -> float:
+    start = time.perf_counter()
+    send_requests(requests)
+    return requests / (time.perf_counter() - start)
+
+
+def keep_alive_benchmark(requests: int, pipeline_depth: int) -> None:
+    from cache import Cache
+    from endpoints import PostsEndpoints
+
+    PostsEndpoints.cache = Cache()
+    http_10_server = start_server(quiet_handler_class("HTTP/1.0"))
+    http_11_server = start_server(quiet_handler_class("HTTP/1.1"))
+
+    def connection_per_request(count):
+        for _ in range(count):
+            connection = http.client.HTTPConnection("localhost", http_10_server.server_port)
+            connection.request("GET", "/posts/")
+            connection.getresponse().read()
+            connection.close()
+
+    def keep_alive(count):
+        connection = http.client.HTTPConnection("localhost", http_11_server.server_port)
+        for _ in range(count):
+            connection.request("GET", "/posts/")
+            connection.getresponse().read()
+        connection.close()
+
+    def pipelined(count):
+        request = b"GET /posts/ HTTP/1.1\r\nHost: localhost\r\n\r\n"
+        with socket.create_connection(("localhost", http_11_server.server_port)) as connection:
+            response_file = connection.makefile("rb")
+            for batch_start in range(0, count, pipeline_depth):
+                batch_size = min(pipeline_depth, count - batch_start)
+                connection.sendall(request * batch_size)
+                for _ in range(batch_size):
+                    read_response(response_file)
+
+    for name, send_requests in (("HTTP/1.0, connection per request", connection_per_request),
+                                ("HTTP/1.1 keep-alive", keep_alive),
+                                (f"HTTP/1.1 pipelined by {pipeline_depth}", pipelined)):
+        print(f"{name:>34}: {requests_per_second(send_requests, requests):,.0f} requests/second")
+
+    http_10_server.shutdown()
+    http_11_server.shutdown()
+
+
+def find_free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        return probe.getsockname()[1]
+
+
+def start_server_process(port: int, *server_arguments: str) -> subprocess.Popen:
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+    process = subprocess.Popen([sys.executable, server_path, "--port", str(port), *server_arguments],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("localhost", port)).close()
+            return process
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError(f"Server with {server_arguments} did not start")
+
+
+def populate_posts(port: int, posts: int) -> list:
+    from cache_benchmark import generate_post, generate_unique_id
+
+    unique_ids = [generate_unique_id(number) for number in range(posts)]
+    connection = http.client.HTTPConnection("localhost", port)
+    connection.request("POST", "/posts/batch", json.dumps([generate_post(unique_id) for unique_id in unique_ids]))
+    connection.getresponse().read()
+    connection.close()
+    return unique_ids
+
+
+async def run_client(port: int, paths: list, deadline: float, latencies: list) -> None:
+    reader, writer = await asyncio.open_connection("localhost", port)
+    number = 0
+    try:
+        while time.perf_counter() < deadline:
+            path = paths[number % len(paths)]
+            number += 1
+            start = time.perf_counter()
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+            await reader.readline()
+            content_length = 0
+            while True:
+                header = await reader.readline()
+                if header == b"\r\n":
+                    break
+                name, value = header.decode("latin-1").split(":", 1)
+                if name.lower() == "content-length":
+                    content_length = int(value)
+            await reader.readexactly(content_length)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def load_test(port: int, paths: list, concurrency: int, duration: float) -> list:
+    latencies = []
+    deadline = time.perf_counter() + duration
+    results = await asyncio.gather(*[run_client(port, paths, deadline, latencies) for _ in range(concurrency)],
+                                   return_exceptions=True)
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures:
+        print(f"{len(failures)} of {concurrency} connections failed, first error: {failures[0]!r}")
+
+    return latencies
+
+
+def engines_benchmark(concurrency: int, duration: float) -> None:
+    for engine in ("threading", "asyncio"):
+        port = find_free_port()
+        server = start_server_process(port, "--engine", engine)
+        try:
+            paths = [f"/posts/{unique_id}" for unique_id in populate_posts(port, 1000)]
+            latencies = sorted(asyncio.run(load_test(port, paths, concurrency, duration)))
+        finally:
+            server.terminate()
+            server.wait()
+
+        if not latencies:
+            print(f"{engine:>10}: no request completed")
+            continue
+
+        p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+        print(f"{engine:>10}: {len(latencies) / duration:,.0f} requests/second, "
+              f"p50 {p50 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms with {concurrency} connections")
+
+
+def count_responses(port: int, paths: list, concurrency: int, duration: float) -> int:
+    return len(asyncio.run(load_test(port, paths, concurrency, duration)))
+
+
+def workers_benchmark(max_workers: int, concurrency: int, duration: float, client_processes: int) -> None:
+    """Requests per second of single post reads while the number of server processes doubles"""
+    print(f"{os.cpu_count()} cores, load from {client_processes} client processes")
+    workers = 1
+    while workers <= max_workers:
+        port = find_free_port()
+        server = start_server_process(port, "--workers", str(workers))
+        try:
+            paths = [f"/posts/{unique_id}" for unique_id in populate_posts(port, 1000)]
+            with multiprocessing.Pool(client_processes) as pool:
+                responses = sum(pool.starmap(count_responses, [(port, paths, concurrency // client_processes,
+                                                                duration)] * client_processes))
+        finally:
+            # Interrupt rather than terminate, the primary process stops its workers on the way out
+            server.send_signal(signal.SIGINT)
+            server.wait()
+
+        print(f"{workers:>3} workers: {responses / duration:,.0f} requests/second with {concurrency} connections")
+        workers *= 2
+
+
+def parse_command_line_arguments() -> argparse.Namespace:
+    argument_parser = argparse.ArgumentParser(description="Server benchmarks")
+    argument_parser.add_argument("mode", choices=["dispatch", "keep_alive", "engines", "workers"])
+    argument_parser.add_argument("--repeat", metavar="repeat", type=int, default=20000)
+    argument_parser.add_argument("--requests", metavar="requests", type=int, default=5000)
+    argument_parser.add_argument("--pipeline_depth", metavar="pipeline_depth", type=int, default=16)
+    argument_parser.add_argument("--concurrency", metavar="concurrency", type=int, default=1000)
+    argument_parser.add_argument("--duration", metavar="duration", type=float, default=10)
+    argument_parser.add_argument("--max_workers", metavar="max_workers", type=int, default=os.cpu_count())
+    argument_parser.add_argument("--client_processes", metavar="client_processes", type=int, default=os.cpu_count())
+    return argument_parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_command_line_arguments()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    # Importing the server loads the cache of the current day, keep it away from real data
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        if arguments.mode == "dispatch":
+            dispatch_benchmark(arguments.repeat)
+        elif arguments.mode == "keep_alive":
+            keep_alive_benchmark(arguments.requests, arguments.pipeline_depth)
+        elif arguments.mode == "engines":
+            engines_benchmark(arguments.concurrency, arguments.duration)
+        elif arguments.mode == "workers":
+            workers_benchmark(arguments.max_workers, arguments.concurrency, arguments.duration,
+                              arguments.client_processes)
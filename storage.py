@@ -0,0 +1,267 @@
+import glob
+import itertools
+import json
+import os
+import sqlite3
+import threading
+from typing import Iterator
+
+from file_management import (
+    iterate_posts, save_all_posts, get_single_post, deserialize_post_data, generate_filename, generate_log_filename,
+    rotate_log, remove_file, append_log_records, read_log_records, file_exist, create_file, get_post_index, LOG_APPEND,
+    LOG_DELETE, truncate_torn_record
+)
+from post_record import PostRecord, POST_FIELDS
+
+
+class TextStorage:
+    """Semicolon separated snapshot with its byte offset index, changes made since the snapshot in a log"""
+
+    # Compaction rewrites the snapshot, so it needs every post
+    snapshot_required = True
+
+    def __init__(self, filename: str = None):
+        self.filename = filename or generate_filename()
+        self.log_filename = generate_log_filename(self.filename)
+        # Held by single post reads and by compaction while it replaces the snapshot and its index together
+        self._replace_lock = threading.Lock()
+        # Opened on the first write, a segment of a past day may never get one
+        self._log_file = None
+
+    def iterate_posts(self) -> Iterator[PostRecord]:
+        return iterate_posts(self.filename)
+
+    def read_log_records(self) -> list:
+        # Log left by an interrupted compaction is older than the active one, so it is replayed first
+        return read_log_records(f"{self.log_filename}.compacting") + read_log_records(self.log_filename)
+
+    def read_post(self, unique_id: str) -> PostRecord or None:
+        with self._replace_lock:
+            serialized_post = get_single_post(self.filename, unique_id)
+
+        return None if serialized_post is None else deserialize_post_data(serialized_post)
+
+    def write_log_records(self, records: list) -> None:
+        if self._log_file is None:
+            truncate_torn_record(self.log_filename)
+            self._log_file = open(self.log_filename, "a")
+
+        append_log_records(self._log_file, records)
+        self._log_file.flush()
+
+    def start_compaction(self) -> str:
+        """Move the log aside, records written from now on are not covered by the coming snapshot"""
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+        return rotate_log(self.log_filename)
+
+    def finish_compaction(self, posts, rotated_log_filename: str) -> int:
+        """Write the snapshot and drop the log it covers, returns the size of the snapshot"""
+        save_all_posts(self.filename, posts, self._replace_lock)
+        remove_file(rotated_log_filename)
+        return os.path.getsize(self.filename)
+
+
+class SQLiteStorage:
+    """Posts in an SQLite table in WAL mode, a written change is already in place and there is no log to replay"""
+
+    # Compaction only checkpoints the write-ahead log into the database
+    snapshot_required = False
+
+    def __init__(self, database: str = None):
+        # One database for good, a name from the date would leave the posts behind on the first restart of a new day
+        self.database = database or "reddit.sqlite3"
+        # Connections are not shared between threads, readers work next to the writer thanks to WAL
+        self._connections = threading.local()
+        # Numeric columns have no type, so that "007" or "12.5k" come back exactly as they were written
+        self._connection().executescript(f"""
+            CREATE TABLE IF NOT EXISTS posts (
+                unique_id TEXT PRIMARY KEY, post_url TEXT, username TEXT, user_karma, user_cake_day TEXT,
+                post_karma, comment_karma, post_date TEXT, comments_number, votes_number, post_category TEXT
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS posts_username ON posts (username);
+            CREATE INDEX IF NOT EXISTS posts_post_category ON posts (post_category);
+            CREATE INDEX IF NOT EXISTS posts_post_date ON posts (post_date);
+        """)
+        # Statements are the same every time, sqlite3 keeps them prepared in its statement cache
+        self._select_all = f"SELECT {', '.join(POST_FIELDS)} FROM posts"
+        self._select_one = f"{self._select_all} WHERE unique_id = ?"
+        self._upsert = f"INSERT OR REPLACE INTO posts ({', '.join(POST_FIELDS)}) " \
+                       f"VALUES ({', '.join('?' * len(POST_FIELDS))})"
+        self._delete = "DELETE FROM posts WHERE unique_id = ?"
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._connections, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.database)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # With WAL a commit survives a crash of the process, only a power loss can take the last ones
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._connections.connection = connection
+
+        return connection
+
+    def iterate_posts(self) -> Iterator[PostRecord]:
+        for row in self._connection().execute(self._select_all):
+            yield PostRecord(*row)
+
+    def read_log_records(self) -> list:
+        return []
+
+    def read_post(self, unique_id: str) -> PostRecord or None:
+        row = self._connection().execute(self._select_one, (unique_id,)).fetchone()
+        return None if row is None else PostRecord(*row)
+
+    def write_log_records(self, records: list) -> None:
+        """Apply the records in one transaction, runs of the same operation go in one executemany"""
+        connection = self._connection()
+        with connection:
+            for deletion, run in itertools.groupby(records, key=lambda record: record[0] == LOG_DELETE):
+                if deletion:
+                    connection.executemany(self._delete, [(unique_id,) for _, unique_id, _ in run])
+                else:
+                    connection.executemany(self._upsert, [post_row(post) for _, _, post in run])
+
+    def start_compaction(self) -> None:
+        return None
+
+    def finish_compaction(self, posts, _) -> int:
+        self._connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return os.path.getsize(self.database)
+
+
+class SegmentedStorage:
+    """Text segments, one per day, listed in a manifest.
+
+    New posts go to the segment of the current day and every later change of a post goes to the segment it was
+    created in, so a post lives in exactly one segment and segments never have to be reconciled with each other.
+    """
+
+    snapshot_required = True
+
+    def __init__(self, manifest_filename: str = None):
+        self.manifest_filename = manifest_filename or "reddit-manifest.json"
+        self._directory = os.path.dirname(self.manifest_filename)
+        self._manifest_lock = threading.Lock()
+        # filename -> segment, oldest first
+        self._segments = {}
+        self._post_counts = {}
+        # unique_id -> segment holding the post
+        self._homes = {}
+        self._modified = set()
+        self._log_records = []
+        self._active = None
+
+        for filename, posts in self._read_manifest():
+            self._add_segment(filename, posts)
+        self._roll_over()
+
+        # Indexes name the posts of every snapshot without parsing them, the logs are read once and kept for the load
+        for segment in self._segments.values():
+            for unique_id in get_post_index(segment.filename):
+                self._homes[unique_id] = segment
+
+            log_records = segment.read_log_records()
+            for operation, unique_id, _ in log_records:
+                if operation == LOG_DELETE:
+                    self._homes.pop(unique_id, None)
+                else:
+                    self._homes[unique_id] = segment
+            self._log_records += log_records
+
+    def _read_manifest(self) -> list:
+        if file_exist(self.manifest_filename):
+            with open(self.manifest_filename, "r") as file:
+                return [(segment["filename"], segment["posts"]) for segment in json.load(file)["segments"]]
+
+        # Files of the days before the manifest existed are looked up this one time, by the date of their name only,
+        # as the crawler writes its results to reddit-YYYYMMDDHHMM.txt next to them
+        filenames = sorted(glob.glob(os.path.join(self._directory, f"reddit-{'[0-9]' * 8}.txt")))
+        return [(os.path.basename(filename), len(get_post_index(filename))) for filename in filenames]
+
+    def _save_manifest(self) -> None:
+        with self._manifest_lock:
+            segments = [{"filename": os.path.basename(filename), "posts": self._post_counts[filename]}
+                        for filename in list(self._segments)]
+            temporary_filename = f"{self.manifest_filename}.tmp"
+            with open(temporary_filename, "w") as file:
+                json.dump({"segments": segments}, file, indent=2)
+            os.replace(temporary_filename, self.manifest_filename)
+
+    def _add_segment(self, filename: str, posts: int = 0) -> TextStorage:
+        path = os.path.join(self._directory, filename)
+        # A segment gets its data file right away, changes of older posts alone never write one
+        if not file_exist(path):
+            create_file(path)
+        self._post_counts[path] = posts
+        self._segments[path] = TextStorage(path)
+        return self._segments[path]
+
+    def _roll_over(self) -> None:
+        """Make the segment of the current day the active one, creating it after midnight"""
+        filename = generate_filename()
+        if self._active is not None and self._active.filename == os.path.join(self._directory, filename):
+            return
+
+        self._active = self._segments.get(os.path.join(self._directory, filename)) or self._add_segment(filename)
+        self._save_manifest()
+
+    def iterate_posts(self) -> Iterator[PostRecord]:
+        for segment in list(self._segments.values()):
+            for post in segment.iterate_posts():
+                # A copy left in an older segment by a post created twice is not the current one
+                if self._homes.get(post["unique_id"]) is segment:
+                    yield post
+
+    def read_log_records(self) -> list:
+        log_records, self._log_records = self._log_records, []
+        return log_records
+
+    def read_post(self, unique_id: str) -> PostRecord or None:
+        segment = self._homes.get(unique_id)
+        return None if segment is None else segment.read_post(unique_id)
+
+    def write_log_records(self, records: list) -> None:
+        self._roll_over()
+        records_per_segment = {}
+        for record in records:
+            operation, unique_id, _ = record
+            if operation == LOG_APPEND or unique_id not in self._homes:
+                segment = self._homes[unique_id] = self._active
+            elif operation == LOG_DELETE:
+                segment = self._homes.pop(unique_id)
+            else:
+                segment = self._homes[unique_id]
+            records_per_segment.setdefault(segment, []).append(record)
+
+        for segment, segment_records in records_per_segment.items():
+            segment.write_log_records(segment_records)
+            self._modified.add(segment)
+
+    def start_compaction(self) -> list:
+        """Rotate the logs of the segments changed since the last compaction, the others are left alone"""
+        modified_segments, self._modified = self._modified, set()
+        return [(segment, segment.start_compaction()) for segment in modified_segments]
+
+    def finish_compaction(self, posts, compactions: list) -> int:
+        for segment, rotated_log_filename in compactions:
+            segment_posts = {unique_id: post for unique_id, post in posts.items()
+                             if self._homes.get(unique_id) is segment}
+            segment.finish_compaction(segment_posts, rotated_log_filename)
+            self._post_counts[segment.filename] = len(segment_posts)
+
+        self._save_manifest()
+        return sum(os.path.getsize(filename) for filename in list(self._segments))
+
+
+STORAGE_ENGINES = {"text": TextStorage, "sqlite": SQLiteStorage, "segmented": SegmentedStorage}
+
+
+def create_storage(engine: str = "text", location: str = None):
+    return STORAGE_ENGINES[engine](location)
+
+
+def post_row(post: PostRecord) -> tuple:
+    return tuple(getattr(post, field) for field in POST_FIELDS)
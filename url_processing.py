@@ -1,11 +1,22 @@
 import re
+from typing import Iterable, Tuple
 
 
-def find_matches(possible_endpoints, uri):
-    for key in possible_endpoints:
-        if re.fullmatch(key[1], uri):
-            return key
+class Router:
+    """Endpoints grouped by method with their patterns compiled once, path parameters come from named groups"""
 
+    def __init__(self, routes: Iterable[Tuple[str, str, str]] = ()):
+        self._routes = {}
+        for method, pattern, handler_name in routes:
+            self.add_route(method, pattern, handler_name)
 
-def get_unique_id_from_url(path: str) -> str:
-    return path.split("/")[2]
+    def add_route(self, method: str, pattern: str, handler_name: str) -> None:
+        self._routes.setdefault(method, []).append((re.compile(pattern), handler_name))
+
+    def match(self, method: str, path: str) -> Tuple[str or None, dict]:
+        for compiled_pattern, handler_name in self._routes.get(method, ()):
+            match = compiled_pattern.fullmatch(path)
+            if match:
+                return handler_name, match.groupdict()
+
+        return None, {}